@@ -3,7 +3,6 @@ import signal
 
 import click
 
-from .client import Client
 from .utils import Utils
 
 utils = Utils()
@@ -37,46 +36,105 @@ def cli(config, loglevel):
 @pass_config
 def setup(config):
     """Setup PinVidderer."""
+    from .client import Client
+
     config.client = Client(loglevel=config.loglevel, is_setup=True)
 
 
 @cli.command(help="Start watching Pinboard.")
+@click.option(
+    "--full-sync",
+    is_flag=True,
+    help="Get every tagged bookmark from Pinboard on the first poll instead of only new or changed ones.",
+)
 @pass_config
-def start(config):
+def start(config, full_sync):
     """Start watching Pinboard."""
+    from .client import Client
+
     config.client = Client(loglevel=config.loglevel)
     client = config.client
-    client.start()
+    client.start(full_sync)
 
 
-@cli.command(help="Run once for a single URL.")
+@cli.command(help="Run once for one or more URLs.")
 @pass_config
-@click.argument("url", nargs=1)
-def runonce(config, url):
-    """Downloads a single video from <URL>."""
+@click.argument("urls", nargs=-1)
+@click.option(
+    "--from-file",
+    type=click.File("r"),
+    help='Read URLs from a file, one per line. "-" reads them from stdin.',
+)
+@click.option(
+    "-j", "--jobs", default=1, show_default=True, type=click.IntRange(min=1), help="Videos to download at once."
+)
+def runonce(config, urls, from_file, jobs):
+    """Downloads the videos at <URLS>, "-" reads URLs from stdin."""
+    from .client import Client
+
+    lines = []
+    if "-" in urls:
+        lines.extend(click.get_text_stream("stdin"))
+    if from_file:
+        lines.extend(from_file)
+    urls = [_u for _u in urls if _u != "-"]
+    urls.extend(_l.strip() for _l in lines if _l.strip() and not _l.strip().startswith("#"))
+    if not urls:
+        raise click.UsageError("No URLs given.")
     config.client = Client(loglevel=config.loglevel)
     client = config.client
-    client.runonce(url)
+    client.runonce(urls, jobs)
 
 
 @cli.command(help="Get the current status and recent history.")
+@click.option("-j", "--json", "as_json", is_flag=True, help="Print the status as JSON.")
 @pass_config
-def status(config):
-    """Get the current status and recent history."""
+def status(config, as_json):
+    """Get the current status and recent history from the running daemon."""
+    from .client import Client
+
     config.client = Client(loglevel=config.loglevel)
     client = config.client
-    client.status()
+    client.status(as_json)
+
+
+@cli.command(help="Wake the running daemon so it checks Pinboard now.")
+@pass_config
+def wake(config):
+    """Wake the running daemon, the same as sending it SIGUSR1."""
+    from .client import Client
+
+    config.client = Client(loglevel=config.loglevel)
+    client = config.client
+    client.wake()
 
 
 @cli.command(help="Get the history.")
 @click.option("-h", "--human", is_flag=True)
 @click.option("-f", "--failed-only", is_flag=True)
+@click.option("-n", "--ndjson", is_flag=True, help="One JSON event per line.")
+@click.option("--limit", type=click.IntRange(min=1), help="Only the most recent <limit> events.")
+@click.option("--since", type=click.DateTime(), help="Only events at or after this date.")
+@click.option("--until", type=click.DateTime(), help="Only events at or before this date.")
+@click.option("--host", help="Only URLs on this domain, e.g. youtube.com.")
+@click.option("--status", type=click.Choice(["completed", "failed", "retrying"]))
 @pass_config
-def get_history(config, human, failed_only):
-    """View the history."""
+def get_history(config, human, failed_only, ndjson, limit, since, until, host, status):
+    """View the history, oldest first."""
+    from .client import Client
+
     config.client = Client(loglevel=config.loglevel)
     client = config.client
-    client.get_history(human, failed_only)
+    client.get_history(
+        human,
+        failed_only,
+        ndjson=ndjson,
+        limit=limit,
+        since=since,
+        until=until,
+        host=host,
+        status=status,
+    )
 
 
 @cli.command(help="Delete an event from the history.")
@@ -85,6 +143,8 @@ def get_history(config, human, failed_only):
 @pass_config
 def remove_from_history(config, url, all_):
     """Remove the event for <URL> from the history."""
+    from .client import Client
+
     config.client = Client(loglevel=config.loglevel)
     client = config.client
     client.remove_from_history(url, all_)
@@ -1,15 +1,17 @@
 """Parse user and configuration file input and start."""
+import json
 import logging
 import os
+import signal
+import threading
 import time
 from datetime import datetime, timedelta
 from logging import handlers
 from pathlib import Path
 
 from .history import History
-from .pinboard import Pinboard
+from .retries import RetryPolicy
 from .utils import DateTimeFormatter, INIConfiguration, Utils
-from .video import Video
 from .pinvidderer_setup import Setup
 
 utils = Utils
@@ -19,6 +21,12 @@ logger = logging.getLogger(__name__)
 
 
 class Client:
+    """The PinVidderer commands.
+
+    Anything that pulls in youtube-dl, requests or lxml is imported by the command that needs it, so history
+    commands start quickly.
+    """
+
     def __init__(self, loglevel, is_setup=False):
         """Load the config and run."""
         self.created_config = False
@@ -33,12 +41,22 @@ class Client:
         loglevel = loglevel or self.configuration.get("dev", {})["log_level"]
         self._setup_logging(loglevel)
         self.pinboard = None
-        history_path = config_dir.joinpath(
+        self.history_path = config_dir.joinpath(
             self.configuration.get("dev", {})["history_file"]
         )
-        self.history = History(history_path=history_path)
+        self._history = None
+
+    @property
+    def history(self) -> History:
+        """The history, opened on first use so `status` and `wake` never read it."""
+        if self._history is None:
+            self._history = History(
+                history_path=self.history_path,
+                retry_policy=RetryPolicy.from_config(self.configuration),
+            )
+        return self._history
 
-    def start(self):
+    def start(self, full_sync=False):
         download_path = Path(
             self.configuration.get("pinvidderer", {}).get("download_path")
         )
@@ -46,52 +64,597 @@ class Client:
             utils.exiter(
                 1, message=f'"Download directory does not exist: {download_path}'
             )
-        self.watcher()
+        self.watcher(full_sync=full_sync)
+
+    def runonce(self, urls, jobs=1):
+        """Download <urls> and print a summary.
+
+        :param urls: URLs to download, duplicates are only downloaded once
+        :type urls: list
+        :param jobs: Number of videos to download at once
+        :type jobs: int
+        """
+        from .custom_exceptions import DownloadStalled
+        from .hosts import HostScheduler
+        from .jobs import JobQueue
+        from .pinboard import Pinboard
+        from .video import Video
+        from .workers import WorkerPool
+
+        queue = JobQueue()
+        for url in urls:
+            # Mock a bookmark and run
+            queue.add(url, description="-- Run Once --")
+        bookmarks = queue.take_new()
+        pinboard = Pinboard(configuration=self.configuration)
+        started = time.time()
+        try:
+            if jobs > 1 and len(bookmarks) > 1:
+                capacity = HostScheduler.from_config(self.configuration).capacity(_b["href"] for _b in bookmarks)
+                if capacity < min(jobs, len(bookmarks)):
+                    logger.warning(
+                        f"--jobs {jobs}, but the [HOSTS] limits only allow {capacity} of these downloads at once."
+                    )
+                pool = WorkerPool(
+                    configuration=self.configuration,
+                    workers=min(jobs, len(bookmarks)),
+                    history=self.history,
+                    pinboard=pinboard,
+                    jobs=queue,
+                )
+                self._handle_shutdown_signals(on_stop=pool.stop)
+                pool.start()
+                for bookmark in bookmarks:
+                    pool.submit(bookmark)
+                pool.join()
+                pool.shutdown()
+            else:
+                video = Video(
+                    configuration=self.configuration,
+                    history=self.history,
+                    pinboard=pinboard,
+                    jobs=queue,
+                )
+                self._handle_shutdown_signals()
+                try:
+                    for bookmark in bookmarks:
+                        while not self.stopping.is_set():
+                            try:
+                                video.preflight(bookmark)
+                                break
+                            except DownloadStalled:
+                                pass  # Retried until it's recorded as failed.
+                            except Exception as err:
+                                logger.exception(f'Error downloading {bookmark["href"]}: {err}')
+                                queue.update(bookmark["href"], "failed", error=err)
+                                break
+                finally:
+                    video.close()
+        finally:
+            pinboard.do_http.close()
+        self._print_runonce_summary(queue.all(), time.time() - started)
+
+    def _handle_shutdown_signals(self, on_stop=None):
+        """Shut down gracefully on SIGINT or SIGTERM, a second signal exits immediately.
+
+        `self.stopping` is set and <on_stop> is called, in-flight downloads have [PINVIDDERER] SHUTDOWN TIMEOUT
+        seconds to finish before they're interrupted. An interrupted download resumes on the next start.
+
+        :param on_stop: Called when the first signal arrives, from a thread, must not block
+        :type on_stop: callable
+        """
+        from . import progress
+
+        self.shutdown_timeout = timeout = float(
+            self.configuration.get("pinvidderer", {}).get("shutdown_timeout", 60)
+        )
+        self.stopping = threading.Event()
+        received = []
+
+        def _shutdown(sig):
+            self.stopping.set()
+            logger.warning(
+                f"{signal.Signals(sig).name}: Shutting down, in-flight downloads have {timeout:.0f} seconds to "
+                f"finish. Send it again to exit now."
+            )
+            if on_stop:
+                on_stop()
+            timer = threading.Timer(timeout, progress.registry.interrupt)
+            timer.daemon = True
+            timer.start()
+
+        relay = self._signal_relay(_shutdown, name="PinVidderer-shutdown")
+
+        def _handler(sig, frame):
+            if received:
+                Utils().signal_handler(sig, frame)
+            received.append(sig)
+            os.write(relay, bytes([sig]))
+
+        for _sig in [signal.SIGINT, signal.SIGTERM]:
+            signal.signal(_sig, _handler)
+
+    @staticmethod
+    def _signal_relay(callback, name) -> int:
+        """Call <callback> from a thread for every signal number written to the returned pipe.
+
+        A signal handler runs in the main thread between any two bytecodes, possibly while it holds a lock
+        <callback> needs (a `Condition`, the scheduler queues), so handlers only write to the pipe.
+
+        :param callback: Called with the signal number
+        :type callback: callable
+        :param name: Name of the thread
+        :type name: str
+        :return: The write end of the pipe
+        :rtype: int
+        """
+        read_fd, write_fd = os.pipe()
+
+        def _relay():
+            while True:
+                sig = os.read(read_fd, 1)
+                if not sig:
+                    return
+                try:
+                    callback(sig[0])
+                except Exception as err:
+                    logger.exception(f"Error handling signal {sig[0]}: {err}")
+
+        threading.Thread(target=_relay, name=name, daemon=True).start()
+        return write_fd
+
+    def _print_runonce_summary(self, jobs, elapsed):
+        """Print the outcome of each runonce URL and the overall throughput.
+
+        :param jobs: The runonce jobs
+        :type jobs: list
+        :param elapsed: Seconds taken
+        :type elapsed: float
+        """
+        total_bytes = 0
+        print(f'\n{"Outcome":<12}{"Size":>12}{"Rate":>16}  URL')
+        for job in jobs:
+            event = self.history.get_event(job["url"]) or {}
+            size = event.get("sizeBytes", 0) if job["state"] == "done" else 0
+            total_bytes += size
+            rate = f'{event["rateStr"]}' if size and event.get("rateStr") else ""
+            print(
+                f'{job["state"]:<12}{utils.format_bytes(size) if size else "":>12}{rate:>16}  {job["url"]}'
+            )
+            if job["error"]:
+                print(f'{"":<12}{job["error"]}')
+        outcomes = {}
+        for job in jobs:
+            outcomes[job["state"]] = outcomes.get(job["state"], 0) + 1
+        print(
+            f"\n{len(jobs)} URL(s): "
+            + ", ".join(f"{_n} {_state}" for _state, _n in sorted(outcomes.items()))
+        )
+        print(
+            f"Downloaded {utils.format_bytes(total_bytes)} in {elapsed:.0f} seconds, "
+            f"{utils.format_bytes(total_bytes / elapsed if elapsed else 0)}/sec"
+        )
+
+    def status(self, as_json=False):
+        """Get the status from the running daemon's control endpoint.
+
+        :param as_json: Print the raw JSON
+        :type as_json: bool
+        """
+        status = self._control_request("GET", "/status")
+        if as_json:
+            print(json.dumps(status, sort_keys=True, indent=2))
+            return
+        print(f'PinVidderer running since {dtf.global24(status["started"])}.')
+        if status["lastPoll"]:
+            print(f'  Last Pinboard poll: {dtf.global24(status["lastPoll"])}')
+        if status["nextWake"]:
+            print(f'  Next wake: {dtf.global24(status["nextWake"])}')
+        print(f'  Queue depth: {status["queueDepth"]}')
+        print(f'  Bookmark updates pending: {status.get("outboxDepth", 0)}')
+        for _window in ["hour", "day"]:
+            _t = status["throughput"][_window]
+            print(
+                f'  Last {_window}: {_t["downloads"]} download(s), {utils.format_bytes(_t["bytes"])}, '
+                f'{utils.format_bytes(_t["rate"])}/sec'
+            )
+        if not status["inFlight"]:
+            print("\nNothing downloading.")
+        for _d in status["inFlight"]:
+            _eta = f'{_d["eta"]:.0f} seconds' if _d["eta"] is not None else "unknown"
+            print(f'\nDownloading: {_d["description"]}')
+            print(f'  URL: {_d["url"]}')
+            print(f'  Downloaded: {utils.format_bytes(_d["downloadedBytes"])}')
+            print(f'  Rate: {utils.format_bytes(_d["rate"])}/sec')
+            print(f"  ETA: {_eta}")
+
+    def wake(self):
+        """Wake the running daemon so it polls Pinboard now."""
+        self._control_request("POST", "/wake")
+        print("Woke PinVidderer.")
+
+    def _control_request(self, method, path, body=None):
+        """Make a request to the running daemon's control endpoint, exits if it isn't running.
+
+        :param method: "GET" or "POST"
+        :type method: str
+        :param path: URL path, e.g. "/status"
+        :type path: str
+        :param body: Sent as JSON
+        :type body: dict
+        :return: The response
+        :rtype: dict
+        """
+        import urllib.request
+
+        control = self.configuration.get("control", {})
+        url = f'http://{control.get("address", "127.0.0.1")}:{control.get("port", 8765)}{path}'
+        data = json.dumps(body).encode() if body is not None else b""
+        request = urllib.request.Request(
+            url,
+            data=data if method == "POST" else None,
+            method=method,
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return json.load(response)
+        except OSError as err:
+            message = f"PinVidderer is not running, or its control endpoint is disabled. ({err})"
+            print(message)
+            utils.exiter(1, message=message)
+
+    def _status(self, query, body):
+        """Handle GET /status on the control endpoint.
+
+        :param query: The query string
+        :type query: dict
+        :param body: Unused
+        :type body: None
+        :return: Status code, status
+        :rtype: int, dict
+        """
+        from . import progress
+
+        return 200, {
+            "started": self.state.started,
+            "lastPoll": self.state.last_poll,
+            "nextWake": self.state.next_wake,
+            "queueDepth": self.state.queue_depth(),
+            "outboxDepth": self.state.outbox_depth(),
+            "inFlight": progress.registry.snapshot(),
+            "throughput": {
+                "hour": progress.registry.throughput(3600),
+                "day": progress.registry.throughput(86400),
+            },
+        }
+
+    def _wake(self, query, body):
+        """Handle POST /wake on the control endpoint.
+
+        :param query: The query string
+        :type query: dict
+        :param body: Unused
+        :type body: dict
+        :return: Status code, response
+        :rtype: int, dict
+        """
+        self.scheduler.wake("control endpoint")
+        return 202, {"woken": True}
+
+    def _submit(self, query, body):
+        """Handle POST /jobs on the control endpoint, submitting URLs for download.
+
+        The body is a job, a list of jobs or {"urls": [...]}. A job is {"url": ..., "description": ...,
+        "priority": ...}, only "url" is required.
+
+        :param query: The query string
+        :type query: dict
+        :param body: The jobs
+        :type body: dict, list
+        :return: Status code, the submitted jobs
+        :rtype: int, dict
+        """
+        if isinstance(body, dict) and "urls" in body:
+            body = [
+                {"url": _u, "priority": body.get("priority", 0)} for _u in body["urls"] or []
+            ]
+        submitted = body if isinstance(body, list) else [body]
+        for _job in submitted:
+            if not isinstance(_job, dict) or not str(_job.get("url", "")).startswith(
+                ("http://", "https://")
+            ):
+                return 400, {"error": f"Not a job with an http(s) URL: {_job}"}
+            try:
+                int(_job.get("priority", 0))
+            except (TypeError, ValueError):
+                return 400, {"error": f'Priority must be an integer: {_job.get("priority")}'}
+        jobs = [
+            self.jobs.add(
+                url=_job["url"],
+                description=_job.get("description", ""),
+                priority=_job.get("priority", 0),
+            )
+            for _job in submitted
+        ]
+        self.scheduler.wake("submitted jobs")
+        return 202, {"jobs": jobs}
+
+    def _job_status(self, query, body):
+        """Handle GET /jobs on the control endpoint, ?id=<job id> gets a single job.
 
-    def runonce(self, url):
-        # Mock a bookmark and run
-        mock_bookmark = {"href": url, "description": "-- Run Once --"}
-        video = Video(configuration=self.configuration)
-        video.preflight(mock_bookmark)
+        :param query: The query string
+        :type query: dict
+        :param body: Unused
+        :type body: None
+        :return: Status code, the job(s) with the progress of any that are downloading
+        :rtype: int, dict
+        """
+        from . import progress
 
-    def status(self):
-        utils.exiter(0, message="TODO")
+        in_flight = {_d["url"]: _d for _d in progress.registry.snapshot()}
+        if "id" in query:
+            jobs = [self.jobs.get(_id) for _id in query["id"]]
+            if None in jobs:
+                return 404, {"error": f'No such job: {query["id"][jobs.index(None)]}'}
+        else:
+            jobs = self.jobs.all()
+        for _job in jobs:
+            _job["progress"] = in_flight.get(_job["url"])
+        return 200, {"jobs": jobs}
 
-    def get_history(self, human, failed):
-        self.history.print(human, failed)
+    def get_history(self, human, failed, **filters):
+        # Read-only, doesn't wait for a writer's lock or compact the history before the first event is printed.
+        history = History(history_path=self.history_path, read_only=True)
+        history.print(human, failed, **filters)
 
     def remove_from_history(self, url, all_):
         self.history.remove(url, all_)
 
-    def watcher(self):
-        """Start watching Pinboard.in."""
+    def watcher(self, full_sync=False):
+        """Start watching Pinboard.in.
+
+        :param full_sync: Get every tagged bookmark on the first poll instead of only new or changed ones
+        :type full_sync: bool
+        """
+        from . import metrics
+        from .control import ControlServer, DaemonState
+        from .custom_exceptions import DownloadStalled, RateLimited
+        from .jobs import JobQueue
+        from .metadata import MetadataPrefetcher
+        from .pinboard import Pinboard
+        from .scheduler import Scheduler
+        from .video import Video
+        from .workers import WorkerPool
+        from .youtubedler import YouTubeDLer
+
         pinboard = Pinboard(configuration=self.configuration)
-        video = Video(configuration=self.configuration)
+        pinboard.outbox.start()
+        config_dir = utils.expand_path(self.configuration.get("dev", {}).get("config_dir", "~/.pinvidderer"))
+        self.jobs = JobQueue(
+            queue_path=config_dir.joinpath(self.configuration.get("dev", {}).get("jobs_file", "jobs.json"))
+        )
+        YouTubeDLer.prune_work_dirs(self.configuration.get("pinvidderer", {}).get("download_path"))
+        workers = int(self.configuration.get("pinvidderer", {}).get("workers", 1))
+        pool = None
+        if workers > 1:
+            pool = WorkerPool(
+                configuration=self.configuration,
+                workers=workers,
+                history=self.history,
+                pinboard=pinboard,
+                jobs=self.jobs,
+            )
+            pool.start()
+        else:
+            video = Video(
+                configuration=self.configuration,
+                history=self.history,
+                pinboard=pinboard,
+                jobs=self.jobs,
+            )
+        prefetcher = None
+        if self.configuration.get("pinvidderer", {}).get("prefetch", True):
+            prefetcher = MetadataPrefetcher(
+                configuration=self.configuration,
+                history=self.history,
+                workers=self.configuration.get("pinvidderer", {}).get(
+                    "prefetch_workers", 4
+                ),
+            )
+        force = self.configuration.get("pinvidderer", {}).get("force")
+        serial_queue = []
+        # URL -> bookmarks for the same video, held back until its download has finished.
+        duplicates = {}
+        self.state = DaemonState()
+        self.state.started = time.time()
+        self.state.queue_depth = (lambda: pool.depth) if pool else (lambda: len(serial_queue))
+        self.state.outbox_depth = lambda: len(pinboard.outbox)
+        poll_interval = int(self.configuration.get("pinvidderer", {}).get("poll_interval", 300))
+        self.scheduler = Scheduler(
+            min_interval=self.configuration.get("pinvidderer", {}).get("min_poll_interval", 30),
+            max_interval=poll_interval,
+        )
+        if hasattr(signal, "SIGUSR1"):
+            wake_relay = self._signal_relay(lambda _sig: self.scheduler.wake("SIGUSR1"), name="PinVidderer-wake")
+            signal.signal(signal.SIGUSR1, lambda _sig, _frame: os.write(wake_relay, bytes([_sig])))
+        inbox_dir = self.configuration.get("pinvidderer", {}).get(
+            "inbox_dir", "~/.pinvidderer/inbox"
+        )
+        if inbox_dir:
+            self.scheduler.watch_inbox(utils.expand_path(inbox_dir))
+        control = None
+        if self.configuration.get("control", {}).get("enabled", True):
+            control = ControlServer(
+                address=self.configuration.get("control", {}).get("address", "127.0.0.1"),
+                port=self.configuration.get("control", {}).get("port", 8765),
+            )
+            control.route("GET", "/status", self._status)
+            control.route("POST", "/wake", self._wake)
+            control.route("POST", "/jobs", self._submit)
+            control.route("GET", "/jobs", self._job_status)
+            control.start()
+        metrics.queue_depth.set_function(self.state.queue_depth)
+        metrics_server = None
+        if self.configuration.get("metrics", {}).get("enabled"):
+            metrics_server = ControlServer(
+                address=self.configuration.get("metrics", {}).get("address", "127.0.0.1"),
+                port=self.configuration.get("metrics", {}).get("port", 9712),
+            )
+            metrics_server.route("GET", "/metrics", lambda _query, _body: (200, metrics.registry.render()))
+            metrics_server.start()
         logger.info("--------- STARTING WATCHER LOOP ---------")
         pb_last_checked = 0
-        poll_interval = self.configuration.get("pinvidderer", {}).get("poll_interval")
-        while True:
-            bookmarks = []
-            pb_last_updated = pinboard.get_last_updated()
-            if pb_last_updated < pb_last_checked:
-                logger.debug(
-                    f"Pinboard has not been updated since {dtf.global24(pb_last_updated)}. Nothing to do."
+        source_tag = self.configuration.get("pinvidderer", {}).get("source_tag")
+        # Anything cached but not handled before the last shutdown, unfinished jobs are already queued.
+        with self.jobs.batch():
+            for _b in pinboard.cache.all():
+                if pinboard.outbox.contains(_b["href"]) or (not force and self._in_history(_b["href"])):
+                    continue
+                self.jobs.add(_b["href"], description=_b["description"], bookmark=_b)
+        bookmarks = []
+
+        def _stop():
+            self.scheduler.wake("shutdown")
+            if pool:
+                pool.stop()
+
+        self._handle_shutdown_signals(on_stop=_stop)
+        try:
+            while not self.stopping.is_set():
+                retry_after = None
+                pb_last_updated = pinboard.get_last_updated()
+                if pb_last_updated < pb_last_checked:
+                    logger.debug(
+                        f"Pinboard has not been updated since {dtf.global24(pb_last_updated)}. Nothing to do."
+                    )
+                    self.scheduler.idle()
+                else:
+                    self.scheduler.activity()
+                    self.state.last_poll = time.time()
+                    try:
+                        # posts/recent is allowed every minute and posts/all every 5, don't hold up the loop for them.
+                        synced = pinboard.sync_bookmarks(source_tag, full=full_sync, max_wait=0)
+                        pb_last_checked = self.state.last_poll
+                        full_sync = False
+                    except RateLimited as err:
+                        logger.info(f"Not syncing bookmarks yet. {err}")
+                        retry_after = err.retry_after
+                        synced = []
+                    # Handled, the bookmark update just hasn't been made on Pinboard yet. Bookmarks already in the
+                    # history (a full sync without REMOVE TAG) don't become jobs, each job is a jobs.json write.
+                    synced = [
+                        _b
+                        for _b in synced
+                        if not pinboard.outbox.contains(_b["href"])
+                        and (force or not self._in_history(_b["href"]))
+                    ]
+                    logger.info(f"Got {len(synced)} bookmark(s) ->")
+                    with self.jobs.batch():
+                        for bookmark in synced:
+                            logger.info(f'  * {bookmark["description"]}')
+                            self.jobs.add(bookmark["href"], description=bookmark["description"], bookmark=bookmark)
+                due = self.history.due_retries()
+                if due:
+                    cached = {_b["href"]: _b for _b in pinboard.cache.all()}
+                    for _event in due:
+                        logger.info(f'Retrying {_event["description"]}, attempt {_event.get("attempts", 1) + 1}.')
+                        self.jobs.add(
+                            _event["url"], description=_event["description"], bookmark=cached.get(_event["url"])
+                        )
+                known = {_b["href"] for _b in bookmarks}
+                bookmarks.extend(_b for _b in self.jobs.take_new() if _b["href"] not in known)
+                if prefetcher:
+                    with self.jobs.batch():
+                        if not force:
+                            for _b in bookmarks:
+                                if self._in_history(_b["href"]):
+                                    self.jobs.update(_b["href"], "skipped", error="Already in the history.")
+                            bookmarks = [_b for _b in bookmarks if not self._in_history(_b["href"])]
+                        for _b in bookmarks:
+                            self.jobs.update(_b["href"], "fetching-metadata")
+                    queued, held = prefetcher.prefetch(bookmarks)
+                    for _b, _info, _original in held:
+                        duplicates.setdefault(_original, []).append((_b, _info))
+                    kept = {_b["href"] for _b, _ in queued} | {_b["href"] for _b, _, _ in held}
+                    with self.jobs.batch():
+                        for _b in bookmarks:
+                            if _b["href"] in kept:
+                                self.jobs.update(_b["href"], "pending")
+                            else:
+                                # youtube-dl couldn't get its info, the failure is in the history.
+                                event = self.history.get_event(_b["href"]) or {}
+                                self.jobs.update(_b["href"], "failed", error=event.get("error", ""))
+                else:
+                    queued = [(_b, None) for _b in reversed(bookmarks)]
+                bookmarks = []
+                queued.extend(self._release_duplicates(duplicates))
+                if pool:
+                    for bookmark, info in queued:
+                        pool.submit(bookmark, info=info, priority=self.jobs.priority(bookmark["href"]))
+                else:
+                    serial_queue.extend(queued)
+                    serial_queue.sort(key=lambda _q: -self.jobs.priority(_q[0]["href"]))
+                while serial_queue and not self.stopping.is_set():
+                    bookmark, info = serial_queue.pop(0)
+                    try:
+                        video.preflight(bookmark, info=info)
+                    except DownloadStalled:
+                        bookmarks.append(bookmark)  # Retried after the next poll.
+                    serial_queue.extend(self._release_duplicates(duplicates))
+                sleep = self.scheduler.interval
+                if retry_after is not None:
+                    sleep = min(sleep, retry_after)
+                next_retry = self.history.next_retry()
+                if next_retry is not None:
+                    sleep = min(sleep, max(next_retry - time.time(), self.scheduler.min_interval))
+                self.state.next_wake = time.time() + sleep
+                logger.info(
+                    f"Sleeping until {datetime.now(tz=None) + timedelta(seconds=sleep)}"
                 )
+                woken = self.scheduler.wait(sleep)
+                if woken:
+                    logger.info(f"Woken by {woken}.")
+        finally:
+            # Jobs, the bookmark cache, the outbox and the history are written atomically as they change, there's
+            # nothing buffered to flush. Anything still queued stays pending in the job queue.
+            for _server in [control, metrics_server]:
+                if _server:
+                    _server.stop()
+            if pool:
+                # Interrupted downloads get a little longer to checkpoint.
+                pool.shutdown(timeout=self.shutdown_timeout + 30 if self.stopping.is_set() else None)
             else:
-                pb_last_checked = time.time()
-                bookmarks = pinboard.get_bookmarks(
-                    self.configuration.get("pinvidderer", {}).get("source_tag")
-                )
-                logger.info(f"Got {len(bookmarks)} bookmark(s) ->")
-                for bookmark in bookmarks:
-                    logger.info(f'  * {bookmark["description"]}')
-            while bookmarks:
-                bookmark = bookmarks.pop()
-                video.preflight(bookmark)
-            logger.info(
-                f"Sleeping until {datetime.now(tz=None) + timedelta(seconds=int(poll_interval))}"
-            )
-            time.sleep(int(poll_interval))
+                video.close()
+            pinboard.outbox.stop(timeout=30)
+            self.scheduler.stop()
+            pinboard.do_http.close()
+            logger.info("--------- WATCHER STOPPED ---------")
+
+    def _release_duplicates(self, duplicates) -> list:
+        """Bookmarks held back as the same video as another bookmark, once the other bookmark's job has finished.
+
+        `Video.preflight` then links them to its download, or tries them itself if it failed, and untags them.
+
+        :param duplicates: URL -> (bookmark, info dict) tuples for the same video, released ones are removed
+        :type duplicates: dict
+        :return: (bookmark, info dict) tuples
+        :rtype: list
+        """
+        released = []
+        for url in [_u for _u in duplicates if self.jobs.finished(_u)]:
+            released.extend(duplicates.pop(url))
+        return released
+
+    def _in_history(self, url) -> bool:
+        """Is <url> in the history, and not a failed download that's due to be retried?
+
+        :param url: Bookmark URL
+        :type url: str
+        :rtype: bool
+        """
+        event = self.history.get_event(url)
+        return bool(event) and not self.history.retry_due(event)
 
     def get_config(self, config_path):
         """Get the user configuration from disk and environment.
@@ -0,0 +1,144 @@
+"""A local HTTP endpoint for the running daemon."""
+import ipaddress
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class ControlServer:
+    """A loopback HTTP server that dispatches GET and POST requests to handlers.
+
+    A handler takes the parsed query string and the request body, parsed as JSON (None if there isn't one), and
+    returns (status code, body). The body is sent as JSON unless it's a string, which is sent as plain text.
+
+    Web pages can make a browser send requests to loopback addresses. Requests whose Host isn't "localhost" or an
+    IP address (DNS rebinding) are refused, as are POSTs that aren't `application/json`, which a browser only
+    sends cross-origin after a CORS preflight this server never answers.
+    """
+
+    def __init__(self, address="127.0.0.1", port=8765):
+        """
+        :param address: Address to listen on
+        :type address: str
+        :param port: Port to listen on
+        :type port: int
+        """
+        self.address = address
+        self.port = int(port)
+        self.routes = {}
+        self._server = None
+        self._thread = None
+
+    def route(self, method, path, handler):
+        """Add a handler.
+
+        :param method: "GET" or "POST"
+        :type method: str
+        :param path: URL path, e.g. "/status"
+        :type path: str
+        :param handler: The handler
+        :type handler: callable
+        """
+        self.routes[(method, path)] = handler
+
+    def start(self):
+        """Start serving on a background thread."""
+        routes = self.routes
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def _dispatch(self, method):
+                if not ControlServer.allowed_host(self.headers.get("Host")):
+                    self._reply(403, {"error": "Requests must be made to localhost or an IP address."})
+                    return
+                content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+                if method == "POST" and content_type != "application/json":
+                    self._reply(415, {"error": "POST requests must be Content-Type: application/json."})
+                    return
+                url = urlparse(self.path)
+                handler = routes.get((method, url.path))
+                if not handler:
+                    self._reply(404, {"error": f"No such endpoint: {method} {url.path}"})
+                    return
+                query = parse_qs(url.query)
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length)) if length else None
+                except ValueError as err:
+                    self._reply(400, {"error": f"The request body is not JSON: {err}"})
+                    return
+                try:
+                    status, response = handler(query, body)
+                except Exception as err:
+                    logger.exception(f"Control endpoint error: {err}")
+                    status, response = 500, {"error": str(err)}
+                self._reply(status, response)
+
+            def _reply(self, status, response):
+                if isinstance(response, str):
+                    body, content_type = response.encode(), "text/plain; version=0.0.4"
+                else:
+                    body = json.dumps(response, default=str).encode()
+                    content_type = "application/json"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"Control endpoint: {format % args}")
+
+        self._server = ThreadingHTTPServer((self.address, self.port), _Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="PinVidderer-control", daemon=True
+        )
+        self._thread.start()
+        logger.info(f"Control endpoint listening on http://{self.address}:{self.port}/")
+
+    @staticmethod
+    def allowed_host(host) -> bool:
+        """Is <host>, a Host header, "localhost" or an IP address?
+
+        :param host: Host header, with or without a port
+        :type host: str
+        :rtype: bool
+        """
+        if not host:
+            return False
+        hostname = urlparse(f"//{host}").hostname
+        if hostname == "localhost":
+            return True
+        try:
+            ipaddress.ip_address(hostname or "")
+        except ValueError:
+            return False
+        return True
+
+    def stop(self):
+        """Stop serving."""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class DaemonState:
+    """What the watcher is doing, for the status endpoint."""
+
+    def __init__(self):
+        self.started = None
+        self.last_poll = None
+        self.next_wake = None
+        self.queue_depth = lambda: 0
+        self.outbox_depth = lambda: 0
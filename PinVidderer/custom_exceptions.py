@@ -37,3 +37,55 @@ class CouldNotFindPathToVideo(Exception):
 
     def __str__(self):
         return f"{self.message}"
+
+
+class DownloadStalled(Exception):
+    """If a download's rate stays below the configured floor."""
+
+    def __init__(self, url, rate, min_rate, seconds):
+        self.url = url
+        self.rate = rate
+        self.seconds = seconds
+        self.message = f"Download stalled at {rate:.0f} B/s, below {min_rate} B/s for {seconds:.0f} seconds."
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"{self.url} -> {self.message}"
+
+
+class DownloadInterrupted(Exception):
+    """If a download is stopped by a shutdown, it's resumed on the next start."""
+
+    def __init__(self, url, message="Download interrupted by shutdown."):
+        self.url = url
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"{self.url} -> {self.message}"
+
+
+class InsufficientDiskSpace(Exception):
+    """If there isn't room for a download, even after evicting videos to stay under the library quota."""
+
+    def __init__(self, url, needed, available):
+        self.url = url
+        self.needed = needed
+        self.available = available
+        self.message = f"Not enough room to download, need {needed} bytes, {available} bytes are available."
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"{self.url} -> {self.message}"
+
+
+class RateLimited(Exception):
+    """If a rate limited call would have to wait longer than the caller allows."""
+
+    def __init__(self, retry_after, message="Rate limited."):
+        self.retry_after = retry_after
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"{self.message} Retry in {self.retry_after:.1f} seconds."
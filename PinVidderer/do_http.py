@@ -2,7 +2,11 @@
 # https://github.com/Gestas/Python-Snippets/
 # https://findwork.dev/blog/advanced-usage-python-requests-timeouts-retries-hooks/
 
+import email.utils
 import logging
+import random
+import threading
+import time
 from urllib.parse import urljoin
 
 import requests
@@ -10,20 +14,59 @@ from requests import Request, Session
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
+from . import metrics
+from .custom_exceptions import RateLimited
+from .ratelimit import TokenBucket
+
 logger = logging.getLogger(__name__)
 
 
 class DoHTTP:
-    """Do a HTTP request."""
+    """Do a HTTP request.
+
+    Requests share one long-lived session so connections are kept alive and reused. The session is safe to
+    share between threads, `pool_maxsize` connections are kept per host and with `pool_block` set callers wait
+    for a free connection rather than opening more than that.
+
+    Requests are rate limited by the `TokenBucket` of every matching path prefix in `rate_limits`, a request
+    waits until all of them have a token. 429 and 5xx responses are retried with capped, jittered exponential
+    backoff that honours Retry-After, a 429 also pauses those buckets for everyone else.
+    """
 
-    def __init__(self, method, endpoint, token):
+    retry_statuses = [429, 500, 502, 503, 504]
+
+    def __init__(
+        self,
+        method,
+        endpoint,
+        token,
+        pool_connections=1,
+        pool_maxsize=4,
+        pool_block=True,
+        keep_alive=True,
+        rate_limits=None,
+        max_retries=5,
+        backoff_base=2.0,
+        backoff_max=60.0,
+    ):
         self._method = method
         self._token = token
         self._endpoint = endpoint
+        self._pool_connections = int(pool_connections)
+        self._pool_maxsize = int(pool_maxsize)
+        self._pool_block = pool_block
+        self._keep_alive = keep_alive
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._rate_limits = rate_limits or {}
+        self._max_retries = int(max_retries)
+        self._backoff_base = float(backoff_base)
+        self._backoff_max = float(backoff_max)
 
+        # Only connection errors are retried by urllib3, status retries are handled in `request`.
         self._retries = Retry(
-            total=20,
-            status_forcelist=[429, 500, 502, 503, 504],
+            total=3,
+            status_forcelist=[],
             method_whitelist=[
                 "HEAD",
                 "GET",
@@ -33,9 +76,42 @@ class DoHTTP:
                 "TRACE",
                 "PROPFIND",
             ],
-            backoff_factor=10,
+            backoff_factor=0.5,
         )
 
+    @property
+    def session(self) -> Session:
+        """The shared session, created on first use.
+
+        :return: The session
+        :rtype: requests.Session
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    _session = Session()
+                    for _prefix in ["http://", "https://"]:
+                        _session.mount(
+                            _prefix,
+                            TimeoutHTTPAdapter(
+                                max_retries=self._retries,
+                                pool_connections=self._pool_connections,
+                                pool_maxsize=self._pool_maxsize,
+                                pool_block=self._pool_block,
+                            ),
+                        )
+                    if not self._keep_alive:
+                        _session.headers["Connection"] = "close"
+                    self._session = _session
+        return self._session
+
+    def close(self):
+        """Close the session and any pooled connections."""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
     def request(self, path, token=None, endpoint=None, method=None, **kwargs):
         """Make a http request.
         :param path: Path for the request
@@ -46,11 +122,13 @@ class DoHTTP:
         :type endpoint: str
         :param method: Request method
         :type method: str
-        :param kwargs: Any other valid `prepared request` parameters
+        :param kwargs: Any other valid `prepared request` parameters. `max_wait` raises `RateLimited` rather
+            than waiting longer than that many seconds for the rate limit or a backoff
         :type kwargs: dict
 
         :return: The response
         :rtype: requests.response
+        :raises RateLimited: The request would have to wait longer than `max_wait`
         """
         _path = path
         _endpoint = endpoint or self._endpoint
@@ -64,6 +142,7 @@ class DoHTTP:
         _verify = kwargs.get("verify", True)
         _raise = kwargs.get("do_raise", True)
         _allow_redirects = kwargs.get("allow_redirects", True)
+        _max_wait = kwargs.get("max_wait")
         _url = urljoin(_endpoint, _path)
 
         _params["auth_token"] = _token
@@ -73,13 +152,7 @@ class DoHTTP:
         if "user_agent" in kwargs:
             _headers["User-Agent"] = kwargs.get("user_agent")
 
-        _requests_session = Session()
-        _requests_session.mount(
-            "http://", TimeoutHTTPAdapter(max_retries=self._retries)
-        )
-        _requests_session.mount(
-            "https://", TimeoutHTTPAdapter(max_retries=self._retries)
-        )
+        _requests_session = self.session
         _request = Request(
             method=_method,
             url=_url,
@@ -88,18 +161,41 @@ class DoHTTP:
             params=_params,
             headers=_headers,
         )
-        _prepared_request = _request.prepare()
+        _prepared_request = _requests_session.prepare_request(_request)
+        _limiters = self._get_limiters(_path)
+        _started = time.monotonic()
         try:
-            _response = _requests_session.send(
-                _prepared_request,
-                timeout=_server_timeout,
-                proxies=_proxy,
-                verify=_verify,
-                allow_redirects=_allow_redirects,
-            )
+            for _attempt in range(self._max_retries + 1):
+                if _limiters:
+                    TokenBucket.acquire_all(_limiters, max_wait=_max_wait)
+                _response = _requests_session.send(
+                    _prepared_request,
+                    timeout=_server_timeout,
+                    proxies=_proxy,
+                    verify=_verify,
+                    allow_redirects=_allow_redirects,
+                )
+                if _response.status_code not in self.retry_statuses or _attempt == self._max_retries:
+                    break
+                _delay = self._backoff(_attempt, _response)
+                logger.warning(
+                    f"{_response.status_code} from {_path}, retry {_attempt + 1}/{self._max_retries} "
+                    f"in {_delay:.1f} seconds."
+                )
+                metrics.pinboard_retries.inc(endpoint=_path)
+                if _limiters and _response.status_code == 429:
+                    for _limiter in _limiters:
+                        _limiter.pause(_delay)
+                if _max_wait is not None and _delay > _max_wait:
+                    raise RateLimited(retry_after=_delay)
+                if not _limiters or _response.status_code != 429:
+                    time.sleep(_delay)  # The limiters wait out a 429 pause.
+            self._record(_path, _response)
             if _raise:
                 _response.raise_for_status()
             return _response
+        except RateLimited:
+            raise
         except requests.exceptions.HTTPError as err:
             logger.error(f"Error: {err}")
         except requests.exceptions.SSLError as err:
@@ -110,6 +206,58 @@ class DoHTTP:
             logger.error(f"Error: {err}")
         except Exception as err:
             logger.error(f"Error: {err}")
+        finally:
+            metrics.pinboard_request_seconds.observe(time.monotonic() - _started, endpoint=_path)
+
+    def _get_limiters(self, path) -> list:
+        """Get the rate limiters for every matching path prefix, e.g. both the general and the posts/all one.
+
+        :param path: Path for the request
+        :type path: str
+        :return: The limiters, empty if the path isn't rate limited
+        :rtype: list
+        """
+        return [_l for _p, _l in self._rate_limits.items() if path.startswith(_p)]
+
+    def _backoff(self, attempt, response) -> float:
+        """Seconds to wait before retrying.
+
+        Full jitter over an exponential backoff capped at `backoff_max`, or the Retry-After header if that's
+        longer.
+
+        :param attempt: Retries so far
+        :type attempt: int
+        :param response: The response being retried
+        :type response: requests.response
+        :return: Seconds to wait
+        :rtype: float
+        """
+        _delay = random.uniform(0, min(self._backoff_max, self._backoff_base * 2 ** attempt))
+        _retry_after = response.headers.get("Retry-After")
+        if _retry_after:
+            try:
+                _seconds = float(_retry_after)
+            except ValueError:
+                try:
+                    _seconds = email.utils.parsedate_to_datetime(_retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    logger.debug(f"Ignoring unparseable Retry-After: {_retry_after}")
+                    _seconds = 0
+            _delay = max(_delay, _seconds)
+        return _delay
+
+    @staticmethod
+    def _record(path, response):
+        """Record the connection retries urllib3 made for a request.
+
+        :param path: Path for the request
+        :type path: str
+        :param response: The response
+        :type response: requests.response
+        """
+        _retries = getattr(response.raw, "retries", None)
+        if _retries is not None and _retries.history:
+            metrics.pinboard_retries.inc(len(_retries.history), endpoint=path)
 
 
 class TimeoutHTTPAdapter(HTTPAdapter):
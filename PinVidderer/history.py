@@ -1,8 +1,16 @@
 """Manage the PinVidderer history."""
 import json
 import logging
+import os
+import sys
+import textwrap
+import time
 from datetime import datetime
 
+from . import metrics
+from .history_store import JSONLogStore
+from .retries import RetryPolicy
+from .urls import CanonicalURL
 from .utils import DateTimeFormatter, Utils
 
 utils = Utils
@@ -12,11 +20,40 @@ logger = logging.getLogger(__name__)
 
 
 class History:
-    """The PinVidderer history."""
+    """The PinVidderer history.
 
-    def __init__(self, history_path):
+    Events are keyed on the bookmarked URL and also indexed on the canonical URL, so URL variants find the same
+    event, and on (extractor, video id) for completed downloads, so the same video from another URL is found.
+
+    A failed download is in the history with the number of failed attempts and, if the `RetryPolicy` says it's
+    worth another try, when to retry it. Until then it's skipped like any other bookmark in the history.
+    """
+
+    def __init__(self, history_path, store=JSONLogStore, retry_policy=None, read_only=False):
+        """
+        :param history_path: Path to the history file
+        :type history_path: Path, str
+        :param store: The storage backend, a `HistoryStore` subclass
+        :type store: type
+        :param retry_policy: Decides which failures are retried, the defaults if not provided
+        :type retry_policy: RetryPolicy
+        :param read_only: For queries, the store doesn't lock, migrate or compact the history and can't add to it
+        :type read_only: bool
+        """
+        self.retry_policy = retry_policy or RetryPolicy()
         self.history_path = utils.expand_path(history_path)
-        self.history_path.touch(exist_ok=True)
+        legacy_path = None
+        if self.history_path.suffix == ".json":
+            # Pre-log history, migrated to <name>.jsonl on first use.
+            legacy_path = self.history_path
+            self.history_path = self.history_path.with_suffix(".jsonl")
+        self.store = store(
+            self.history_path,
+            legacy_path=legacy_path,
+            indexes={"canonicalUrl": self._canonical_key, "video": self._video_key},
+            ordered_indexes={"nextRetry": self._retry_key},
+            read_only=read_only,
+        )
 
     def add(self, **kwargs: dict):
         """Add an event to the PinVidderer history.
@@ -28,21 +65,109 @@ class History:
             "dateTime": str(datetime.now(tz=None)),
             "videoFile": str(kwargs.get("videofile", "")),
             "url": kwargs["url"],
+            "canonicalUrl": CanonicalURL.canonicalize(kwargs["url"]),
             "description": kwargs["description"],
             "downloadCompleted": kwargs["download_completed"],
             "error": kwargs.get("error", ""),
         }
         if "stats" in kwargs:
             _event.update(kwargs["stats"])
+        if not _event["downloadCompleted"]:
+            previous = self.store.get(_event["url"])
+            attempts = 1
+            if previous and not previous["downloadCompleted"]:
+                attempts += previous.get("attempts", 1)
+            retryable = self.retry_policy.retryable(_event["error"])
+            _event["attempts"] = attempts
+            _event["retryable"] = retryable
+            _event["nextRetry"] = self.retry_policy.next_retry(attempts) if retryable else None
         self._add(_event)
 
     def get_event(self, url: str):
         """Return a specific event from the PinVidderer history.
 
-        :param url: url to search for
+        :param url: url to search for, an event for any variant of it is found
+        """
+        return self.store.get(url) or self.store.find(
+            "canonicalUrl", CanonicalURL.canonicalize(url)
+        )
+
+    def mark_evicted(self, event, reason):
+        """Record that the video for <event> was deleted to make room.
+
+        :param event: A completed download
+        :type event: dict
+        :param reason: Why it was evicted
+        :type reason: str
         """
-        _history = self.get()
-        return next((_e for _e in _history if _e["url"] == url), None)
+        _event = dict(event)
+        _event["downloadedAt"] = event.get("downloadedAt", event["dateTime"])
+        _event["dateTime"] = str(datetime.now(tz=None))
+        _event["evicted"] = True
+        _event["evictedReason"] = reason
+        self._add(_event)
+
+    @staticmethod
+    def retry_due(event, now=None) -> bool:
+        """Is <event> a failed download that's due to be retried?
+
+        :param event: A history event
+        :type event: dict
+        :param now: Epoch time, defaults to now
+        :type now: float
+        :rtype: bool
+        """
+        next_retry = event.get("nextRetry")
+        if event["downloadCompleted"] or next_retry is None:
+            return False
+        return next_retry <= (now or time.time())
+
+    def due_retries(self) -> list:
+        """Failed downloads that are due to be retried, the longest overdue first.
+
+        :return: Events
+        :rtype: list
+        """
+        return self.store.ordered("nextRetry", until=time.time())
+
+    def next_retry(self):
+        """When the next failed download is due to be retried.
+
+        :return: Epoch time, None if nothing will be retried
+        :rtype: float
+        """
+        retries = self.store.ordered("nextRetry", limit=1)
+        return retries[0]["nextRetry"] if retries else None
+
+    def find_video(self, extractor_key, video_id):
+        """Return the completed download of a video, from any URL.
+
+        :param extractor_key: youtube-dl extractor key, e.g. "Youtube"
+        :type extractor_key: str
+        :param video_id: The video's id on that site
+        :type video_id: str
+        :return: The event, None if the video hasn't been downloaded
+        :rtype: dict
+        """
+        if not extractor_key or not video_id:
+            return None
+        return self.store.find("video", f"{extractor_key}:{video_id}")
+
+    @staticmethod
+    def _canonical_key(event):
+        return event.get("canonicalUrl") or CanonicalURL.canonicalize(event["url"])
+
+    @staticmethod
+    def _retry_key(event):
+        if event["downloadCompleted"]:
+            return None
+        return event.get("nextRetry")
+
+    @staticmethod
+    def _video_key(event):
+        if not event.get("downloadCompleted") or event.get("evicted") or not event.get("videoId"):
+            return None
+        return f'{event.get("extractorKey")}:{event["videoId"]}'
 
     def get(self) -> list:
         """Get the entire PinVidderer history.
@@ -50,12 +175,7 @@ class History:
         :return: A list of events
         :rtype: list
         """
-        try:
-            with open(self.history_path, "r") as file:
-                history = json.load(file)
-        except json.JSONDecodeError:  # If file is empty or corrupted.
-            return []
-        return history
+        return self.store.all()
 
     def _add(self, event: dict):
         """Persist a new event to disk.
@@ -64,11 +184,9 @@ class History:
         :type event: dict
         """
         _event = event
-        logger.debug(f"  Adding event to history: {json.dumps(_event)}")
-        _new_history = [_e for _e in self.get() if _e["url"] != _event["url"]]
-        _new_history.append(_event)
-        with open(self.history_path, "w") as file:
-            json.dump(_new_history, file, indent=2)
+        logger.debug(f"  Adding event to history: {json.dumps(_event, default=str)}")
+        with metrics.history_write_seconds.time():
+            self.store.put(_event)
 
     def remove(self, url: str, all_: bool):
         """Remove an event from the PinVidderer history.
@@ -78,16 +196,12 @@ class History:
         :param all_: Delete the entire history
         :param all_: bool
         """
-        history = self.get()
-        original_length = len(history)
         if all_:
-            new_history = []
+            removed = bool(self.store.all())
+            self.store.clear()
         else:
-            new_history = [_e for _e in history if _e["url"] != url]
-        new_length = len(new_history)
-        with open(self.history_path, "w") as file:
-            json.dump(new_history, file, indent=2)
-        if original_length > new_length:
+            removed = self.store.remove(url)
+        if removed:
             logger.info(f"Removed {url} from history.")
             utils.exiter(0)
         else:
@@ -96,33 +210,130 @@ class History:
                 utils.exiter(1)
             utils.exiter(0)
 
-    def print(self, human, failed):
-        """Print the PinVidderer history.
+    def query(self, limit=None, since=None, until=None, host=None, status=None):
+        """Iterate over the events that match every filter, oldest first.
+
+        Events are stored in the order they were added. With <since> or <limit> they're read newest first and
+        reading stops as soon as it has passed the last match, a read-only store then only reads the end of the
+        log. <host> and <status> are checked against each event as it's read. Without either, every event is read
+        before the first is returned, a later record can replace or remove any event.
+
+        :param limit: Only the <limit> most recent matches
+        :type limit: int
+        :param since: Only events at or after <since>
+        :type since: datetime
+        :param until: Only events at or before <until>
+        :type until: datetime
+        :param host: Only URLs on this domain or its subdomains
+        :type host: str
+        :param status: Only "completed" or "failed" downloads, or "retrying" failed downloads that will be retried
+        :type status: str
+        :return: Events
+        :rtype: Iterator[dict]
+        """
+        # dateTime is str(datetime), which sorts as a string.
+        since = str(since) if since else None
+        until = str(until) if until else None
+        if host:
+            host = CanonicalURL.host(f"https://{host}")
+
+        def matches(_event):
+            if status and _event["downloadCompleted"] is not (status == "completed"):
+                return False
+            if status == "retrying" and _event.get("nextRetry") is None:
+                return False
+            if host:
+                _host = CanonicalURL.host(self._canonical_key(_event))
+                if _host != host and not _host.endswith(f".{host}"):
+                    return False
+            return True
+
+        if limit is None and not since:
+            for _event in self.store.events():
+                if until and _event["dateTime"] > until:
+                    break
+                if matches(_event):
+                    yield _event
+            return
+        newest = []
+        for _event in self.store.events(newest_first=True):
+            if (limit and len(newest) >= limit) or (since and _event["dateTime"] < since):
+                break
+            if until and _event["dateTime"] > until:
+                continue
+            if matches(_event):
+                newest.append(_event)
+        yield from reversed(newest)
+
+    def print(self, human=False, failed=False, ndjson=False, **filters):
+        """Print the PinVidderer history as it's read, `get-history --limit 10 | head` only reads the end of the log.
 
         :param human: Format for humans
         :type human: bool
         :param failed: Only display failed downloads
         :type failed: bool
+        :param ndjson: One JSON event per line instead of a JSON list
+        :type ndjson: bool
+        :param filters: `query` filters
+        :type filters: dict
         """
-        history = self.get()
         if failed:
-            history = [d for d in history if d["downloadCompleted"] is False]
-        if human:
-            if not history:
-                print("The history is empty.")
-            for _event in history:
-                _dt = dtf(dt=_event["dateTime"])
-                print(f'\nTitle: {_event["description"]}')
-                print(f"  Date: {_dt.world_24}")
-                print(f'  URL: {_event["url"]}')
-                if _event["downloadCompleted"]:
-                    print("  Result: Success")
+            filters["status"] = "failed"
+        events = self.query(**filters)
+        try:
+            if human:
+                self._print_human(events, filtered=bool(failed or any(filters.values())))
+            elif ndjson:
+                for _event in events:
+                    print(json.dumps(_event, sort_keys=True, default=str))
+            else:
+                self._print_json_list(events)
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # The reader went away (`| head`), don't complain about it on the way out.
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+    @staticmethod
+    def _print_json_list(events):
+        """Print <events> as an indented JSON list, one event at a time."""
+        separator = "[\n"
+        for _event in events:
+            _json = json.dumps(_event, sort_keys=True, indent=2, default=str)
+            print(separator + textwrap.indent(_json, "  "), end="")
+            separator = ",\n"
+        print("[]" if separator == "[\n" else "\n]")
+
+    @staticmethod
+    def _print_human(events, filtered=False):
+        empty = True
+        for _event in events:
+            empty = False
+            print(f'\nTitle: {_event["description"]}')
+            print(f'  Date: {dtf().global24(_event["dateTime"])}')
+            print(f'  URL: {_event["url"]}')
+            if _event["downloadCompleted"]:
+                print("  Result: Success")
+                if "linkedFrom" in _event:
+                    print(f'  Same video as: {_event["linkedFrom"]}')
+                if "sizeStr" in _event:
                     print(f'  Size: {_event["sizeStr"]}')
                     print(f'  Took: {_event["elapsedStr"]}')
                     print(f'  Download rate: {_event["rateStr"]}')
-                    print(f'  Video: {_event["videoFile"]}')
-                else:
-                    print("  Result: Failed")
-                    print(f'  Error: {_event["error"]}')
-        else:
-            print(json.dumps(history, sort_keys=True, indent=2))
+                if "rateP50Str" in _event:
+                    print(f'  Rate p50/p95: {_event["rateP50Str"]} / {_event["rateP95Str"]}')
+                if "finalizeStr" in _event:
+                    print(f'  Moved: {_event["finalizeStr"]}')
+                print(f'  Video: {_event["videoFile"]}')
+                if _event.get("evicted"):
+                    print(f'  Evicted: {dtf().global24(_event["dateTime"])}, {_event["evictedReason"]}')
+            else:
+                print("  Result: Failed")
+                print(f'  Error: {_event["error"]}')
+                if "attempts" in _event:
+                    print(f'  Attempts: {_event["attempts"]}')
+                if _event.get("nextRetry"):
+                    print(f'  Next retry: {dtf().global24(_event["nextRetry"])}')
+                elif "retryable" in _event:
+                    print("  Next retry: Never")
+        if empty:
+            print("No events match." if filtered else "The history is empty.")
@@ -0,0 +1,486 @@
+"""Storage backends for the PinVidderer history."""
+import io
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+from .utils import Utils
+
+try:
+    import fcntl
+except ImportError:  # Windows, writes from separate processes aren't serialized.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+utils = Utils
+
+
+class HistoryStore(ABC):
+    """The interface a history backend has to provide.
+
+    Events are keyed on their "url", a URL has at most one event.
+    """
+
+    @abstractmethod
+    def get(self, url: str):
+        """Return the event for <url> or None."""
+
+    @abstractmethod
+    def all(self) -> list:
+        """Return every event, oldest first."""
+
+    @abstractmethod
+    def find(self, index: str, key):
+        """Return the event with <key> in the secondary index <index>, or None."""
+
+    @abstractmethod
+    def ordered(self, index: str, until=None, limit=None) -> list:
+        """Return the events in the ordered index <index>, lowest key first. Only keys up to <until> and at most
+        <limit> events, if given."""
+
+    def events(self, newest_first=False):
+        """Iterate over a snapshot of the events, in the order they were put."""
+        events = self.all()
+        return reversed(events) if newest_first else iter(events)
+
+    @abstractmethod
+    def put(self, event: dict):
+        """Add or replace the event for event["url"]."""
+
+    @abstractmethod
+    def remove(self, url: str) -> bool:
+        """Remove the event for <url>. Returns False if there wasn't one."""
+
+    @abstractmethod
+    def clear(self):
+        """Remove every event."""
+
+
+class JSONLogStore(HistoryStore):
+    """An append-only JSON Lines log with an in-memory URL index.
+
+    Every change is appended to the log as a single line, the index is rebuilt
+    from the log on startup and then kept current by reading only the bytes
+    appended since the last read. That also picks up events written by other
+    PinVidderer processes (`runonce` while `start` is running).
+    The log is compacted once stale records outnumber live events.
+
+    Writers, in any process, take an exclusive `fcntl` lock on a sidecar lock
+    file and fsync before returning. Compaction writes a temp file and
+    `os.replace`s the log. Readers don't lock, they read the open file up to
+    its last complete line, which is always a consistent snapshot. A partial
+    line left by a crash mid-append is dropped by the next writer.
+
+    Opened `read_only` (the query commands) the store never locks, migrates or
+    compacts and the secondary and ordered indexes are only built if `find` or
+    `ordered` is called. Nothing is read until it's asked for. Newest first, the
+    events are streamed from the end of the log, the first record seen for a URL
+    is its current state, so a query that stops early only reads the end of the
+    log. Anything else reads the whole log, a later record can replace or remove
+    any event.
+    """
+
+    compact_min_records = 1000
+    read_block_size = 1 << 16
+
+    def __init__(self, log_path, legacy_path=None, indexes=None, ordered_indexes=None, read_only=False):
+        """
+        :param log_path: Path to the JSON Lines log
+        :type log_path: Path
+        :param legacy_path: Path to a pre-log `history.json`, migrated if present
+        :type legacy_path: Path
+        :param indexes: Secondary index name -> function returning an event's key in it, or None to leave it out
+        :type indexes: dict
+        :param ordered_indexes: Ordered index name -> function returning an event's sort key, or None to leave it out
+        :type ordered_indexes: dict
+        :param read_only: Don't lock, migrate or compact, writes raise `io.UnsupportedOperation`
+        :type read_only: bool
+        """
+        self.log_path = Path(log_path)
+        self.lock_path = self.log_path.with_name(f".{self.log_path.name}.lock")
+        self._index = OrderedDict()
+        self.indexes = indexes or {}
+        self.ordered_indexes = ordered_indexes or {}
+        self.read_only = read_only
+        # Built on the first `find` or `ordered` when read-only, most queries never use them.
+        self._secondary = None
+        # Ordered index name -> (sorted [(key, url)], {url: key})
+        self._ordered = None
+        if not read_only:
+            self._new_indexes()
+        self._offset = 0
+        self._records = 0
+        self._inode = None
+        self._file = None
+        self._lock = threading.RLock()
+        if read_only:
+            if legacy_path and not self.log_path.exists():
+                # Not migrated yet, read the old history without converting it.
+                for event in self._read_legacy(Path(legacy_path)).values():
+                    self._apply({"op": "put", "event": event})
+            return
+        with self._locked():
+            if legacy_path and not self.log_path.exists():
+                self._migrate(Path(legacy_path))
+            self.log_path.touch(exist_ok=True)
+            self._refresh()
+            self._maybe_compact()
+
+    def get(self, url: str):
+        with self._lock:
+            self._refresh()
+            return self._index.get(url)
+
+    def all(self) -> list:
+        with self._lock:
+            self._refresh()
+            return list(self._index.values())
+
+    def events(self, newest_first=False):
+        if newest_first and self.read_only and self._file is None and not self._index:
+            # Nothing has been read yet, stream from the end of the log rather than reading all of it first.
+            return self._stream_newest_first()
+        return super().events(newest_first=newest_first)
+
+    def find(self, index: str, key):
+        with self._lock:
+            self._refresh()
+            self._build_indexes()
+            url = self._secondary[index].get(key)
+            return self._index.get(url) if url else None
+
+    def ordered(self, index: str, until=None, limit=None) -> list:
+        with self._lock:
+            self._refresh()
+            self._build_indexes()
+            events = []
+            for key, url in self._ordered[index][0]:
+                if (until is not None and key > until) or len(events) == limit:
+                    break
+                events.append(self._index[url])
+            return events
+
+    def put(self, event: dict):
+        self._append({"op": "put", "event": event})
+
+    def remove(self, url: str) -> bool:
+        with self._lock:
+            self._refresh()
+            if url not in self._index:
+                return False
+            self._append({"op": "remove", "url": url})
+            return True
+
+    def clear(self):
+        self._append({"op": "clear"})
+
+    def _append(self, record: dict):
+        """Append a record to the log and fold it into the index.
+
+        :param record: A log record
+        :type record: dict
+        """
+        if self.read_only:
+            raise io.UnsupportedOperation(f"{self.log_path} was opened read-only.")
+        line = (json.dumps(record, default=str) + "\n").encode()
+        with self._locked():
+            with open(self.log_path, "a+b") as file:
+                self._repair_tail(file)
+                file.write(line)
+                file.flush()
+                os.fsync(file.fileno())
+            # Read it back rather than applying it directly, anything another
+            # process appended in the meantime is applied in log order.
+            self._refresh()
+            self._maybe_compact()
+
+    @contextmanager
+    def _locked(self):
+        """Hold the thread lock and the cross-process lock."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _repair_tail(file):
+        """Drop a partial record at the end of the log, the write it came from never finished.
+
+        :param file: The log, opened "a+b"
+        :type file: BinaryIO
+        """
+        size = file.seek(0, os.SEEK_END)
+        if not size:
+            return
+        file.seek(size - 1)
+        if file.read(1) == b"\n":
+            return
+        keep, end = 0, size
+        while end > 0:
+            start = max(end - 65536, 0)
+            file.seek(start)
+            newline = file.read(end - start).rfind(b"\n")
+            if newline != -1:
+                keep = start + newline + 1
+                break
+            end = start
+        logger.warning(f"Dropping a partial history record, {size - keep} bytes.")
+        file.truncate(keep)
+
+    def _apply(self, record: dict):
+        op = record.get("op")
+        if op == "put":
+            event = record["event"]
+            keys = {}
+            if self._secondary is not None:
+                keys = {_name: _f(event) for _name, _f in self.indexes.items()}
+            self._unindex(self._index.pop(event["url"], None), keep=keys)
+            self._index[event["url"]] = event
+            self._index_event(event, keys)
+        elif op == "remove":
+            self._unindex(self._index.pop(record["url"], None))
+        elif op == "clear":
+            self._index.clear()
+            self._clear_indexes()
+        self._records += 1
+
+    def _new_indexes(self):
+        self._secondary = {_name: {} for _name in self.indexes}
+        self._ordered = {_name: ([], {}) for _name in self.ordered_indexes}
+
+    def _build_indexes(self):
+        """Build the secondary and ordered indexes if they were left out, read-only."""
+        if self._secondary is not None:
+            return
+        self._new_indexes()
+        for event in self._index.values():
+            self._index_event(event)
+
+    def _clear_indexes(self):
+        for secondary in (self._secondary or {}).values():
+            secondary.clear()
+        for entries, keys in (self._ordered or {}).values():
+            entries.clear()
+            keys.clear()
+
+    def _index_event(self, event, keys=None):
+        """Add <event> to the secondary and ordered indexes.
+
+        :param keys: Secondary index name -> key, if already worked out
+        """
+        if self._secondary is None:
+            return
+        for name, key_function in self.indexes.items():
+            key = keys[name] if keys else key_function(event)
+            if key is not None:
+                self._secondary[name][key] = event["url"]
+        for name, key_function in self.ordered_indexes.items():
+            key = key_function(event)
+            if key is not None:
+                entries, urls = self._ordered[name]
+                insort(entries, (key, event["url"]))
+                urls[event["url"]] = key
+
+    def _unindex(self, event, keep=None):
+        """Remove <event> from the ordered and secondary indexes, in a secondary index the newest other event
+        with the same key takes over.
+
+        :param keep: Index name -> key, keys the replacing event has and so don't need a new owner
+        """
+        if not event or self._secondary is None:
+            return
+        for entries, urls in self._ordered.values():
+            key = urls.pop(event["url"], None)
+            if key is not None:
+                del entries[bisect_left(entries, (key, event["url"]))]
+        for name, key_function in self.indexes.items():
+            key = key_function(event)
+            if key is None or (keep and keep.get(name) == key):
+                continue
+            if self._secondary[name].get(key) != event["url"]:
+                continue
+            del self._secondary[name][key]
+            for other in reversed(self._index.values()):
+                if key_function(other) == key:
+                    self._secondary[name][key] = other["url"]
+                    break
+
+    def _refresh(self):
+        """Apply any records appended to the log since the last read."""
+        try:
+            inode = os.stat(self.log_path).st_ino
+            if self._file is None or inode != self._inode:
+                # New or replaced (compacted) log, start over. The log is kept open until it's replaced, so its
+                # inode can't be freed and reused by a later compaction while it's remembered here.
+                self._close_log()
+                self._file = open(self.log_path, "rb")
+                # Stat the open file, not the path, the path may have been replaced again since.
+                self._reset(os.fstat(self._file.fileno()).st_ino)
+        except FileNotFoundError:
+            # Only forget what was read from a log that's gone, a read-only store of a history that hasn't been
+            # migrated has never had one.
+            if self._inode is not None:
+                self._close_log()
+                self._reset(None)
+            return
+        size = os.fstat(self._file.fileno()).st_size
+        if size < self._offset:
+            # Truncated, start over.
+            self._reset(self._inode)
+        if size == self._offset:
+            return
+        self._file.seek(self._offset)
+        data = self._file.read(size - self._offset)
+        # Only consume complete lines, a writer may be mid-append.
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                self._apply(json.loads(line))
+            except (json.JSONDecodeError, KeyError, TypeError) as err:
+                logger.warning(f"Skipping corrupt history record: {err}")
+        self._offset += end
+
+    def _stream_newest_first(self):
+        """Yield the current events newest first, reading the log backwards.
+
+        Only the log as it was when it was opened is read, records appended since are left out.
+        """
+        try:
+            file = open(self.log_path, "rb")
+        except FileNotFoundError:
+            return
+        seen = set()
+        with file:
+            for line in self._lines_backwards(file, self.read_block_size):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    op = record.get("op")
+                    if op == "clear":
+                        return
+                    url = record["event"]["url"] if op == "put" else record["url"] if op == "remove" else None
+                except (json.JSONDecodeError, KeyError, TypeError, AttributeError) as err:
+                    logger.warning(f"Skipping corrupt history record: {err}")
+                    continue
+                if url is None or url in seen:
+                    continue
+                seen.add(url)
+                if op == "put":
+                    yield record["event"]
+
+    @staticmethod
+    def _lines_backwards(file, block_size):
+        """Yield the complete lines of <file>, last first. A partial line at the end is left out, a writer may be
+        mid-append.
+
+        :param file: The log, opened "rb"
+        :type file: BinaryIO
+        :param block_size: Bytes to read at a time
+        :type block_size: int
+        """
+        position = os.fstat(file.fileno()).st_size
+        # The start of a line that continues in the block already read, None until the last newline is found.
+        buffer = None
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            file.seek(position)
+            block = file.read(step)
+            if buffer is None:
+                newline = block.rfind(b"\n")
+                if newline == -1:
+                    continue
+                buffer = block[:newline]
+            else:
+                buffer = block + buffer
+            lines = buffer.split(b"\n")
+            buffer = lines.pop(0)
+            yield from reversed(lines)
+        if buffer:
+            yield buffer
+
+    def _reset(self, inode):
+        self._index.clear()
+        self._clear_indexes()
+        self._offset = 0
+        self._records = 0
+        self._inode = inode
+
+    def _close_log(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _maybe_compact(self):
+        if self._records < self.compact_min_records:
+            return
+        if self._records < 2 * len(self._index):
+            return
+        self._rewrite(self._index.values())
+
+    def _rewrite(self, events):
+        """Replace the log with one "put" record per event.
+
+        :param events: The events to keep
+        :type events: Iterable[dict]
+        """
+        tmp_path = self.log_path.with_name(f".{self.log_path.name}.tmp")
+        with open(tmp_path, "w") as file:
+            for event in events:
+                file.write(json.dumps({"op": "put", "event": event}, default=str) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.log_path)
+        utils.fsync_dir(self.log_path.parent)
+        logger.debug(f"Compacted the history log {self.log_path}.")
+        self._refresh()
+
+    def _migrate(self, legacy_path: Path):
+        """Convert a `history.json` list into a log.
+
+        :param legacy_path: Path to the old history file
+        :type legacy_path: Path
+        """
+        if not legacy_path.exists():
+            return
+        migrated = self._read_legacy(legacy_path)
+        logger.info(
+            f"Migrating {len(migrated)} event(s) from {legacy_path} to {self.log_path}."
+        )
+        self._rewrite(migrated.values())
+        legacy_path.rename(legacy_path.with_name(f"{legacy_path.name}.migrated"))
+
+    @staticmethod
+    def _read_legacy(legacy_path: Path) -> OrderedDict:
+        """Read a `history.json` list.
+
+        :param legacy_path: Path to the old history file
+        :type legacy_path: Path
+        :return: URL -> event, the last event for each URL
+        :rtype: OrderedDict
+        """
+        try:
+            with open(legacy_path, "r") as file:
+                events = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):  # Missing, empty or corrupted, nothing to keep.
+            events = []
+        legacy = OrderedDict()
+        for event in events:
+            legacy.pop(event["url"], None)
+            legacy[event["url"]] = event
+        return legacy
@@ -0,0 +1,220 @@
+"""Per-host download scheduling."""
+import heapq
+import logging
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+from .urls import CanonicalURL
+
+logger = logging.getLogger(__name__)
+
+
+class HostScheduler:
+    """A download queue that spreads work across hosts.
+
+    Each host has its own queue, a maximum number of concurrent downloads and a minimum time between download
+    starts. `get` hands out the highest priority item from any host that's allowed to start a download, hosts
+    with the same priority take turns. A URL is scheduled under the longest domain in the limits that its
+    canonical host is in, otherwise under its registrable domain, so "youtu.be", "m.youtube.com" and
+    "youtube.com" share one host's limits.
+    """
+
+    def __init__(self, limits=None, default_concurrency=2, default_spacing=0.0):
+        """
+        :param limits: Domain -> (max concurrency, min spacing in seconds)
+        :type limits: dict
+        :param default_concurrency: Max concurrency for hosts not in <limits>
+        :type default_concurrency: int
+        :param default_spacing: Min spacing for hosts not in <limits>, in seconds
+        :type default_spacing: float
+        """
+        self.limits = {_d.lower(): _l for _d, _l in (limits or {}).items()}
+        self.default_concurrency = max(int(default_concurrency), 1)
+        self.default_spacing = float(default_spacing)
+        self._queues = {}
+        self._rotation = deque()
+        self._active = {}
+        self._next_start = {}
+        self._unfinished = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_config(cls, configuration):
+        """Build a scheduler from the [HOSTS] section.
+
+        :param configuration: The PinVidderer configuration
+        :type configuration: dict
+        :return: The scheduler
+        :rtype: HostScheduler
+        """
+        hosts = dict(configuration.get("hosts", {}))
+        default_concurrency = hosts.pop("default_concurrency", 2)
+        default_spacing = hosts.pop("default_spacing", 0)
+        limits = {}
+        for domain, value in hosts.items():
+            try:
+                limits[domain] = cls.parse_limit(value, default_spacing)
+            except ValueError:
+                logger.error(f'Ignoring the [HOSTS] limit for {domain}, expected "<concurrency>, <spacing>": {value}')
+        return cls(
+            limits=limits,
+            default_concurrency=int(default_concurrency),
+            default_spacing=float(default_spacing),
+        )
+
+    @staticmethod
+    def parse_limit(value, default_spacing=0.0) -> tuple:
+        """Parse a "<max concurrency>, <min spacing>" limit, the spacing is optional.
+
+        :param value: The config value, "1" and "0" are already booleans
+        :type value: str, bool
+        :param default_spacing: Spacing if <value> doesn't have one, in seconds
+        :type default_spacing: float
+        :return: Max concurrency, min spacing
+        :rtype: tuple
+        """
+        if isinstance(value, bool):
+            return max(int(value), 1), float(default_spacing)
+        parts = [_p.strip() for _p in str(value).split(",")]
+        spacing = float(parts[1]) if len(parts) > 1 else float(default_spacing)
+        return max(int(parts[0]), 1), spacing
+
+    def host(self, url) -> str:
+        """The host <url> is scheduled under, the longest matching domain in the limits or its registrable domain.
+
+        :param url: URL of the video
+        :type url: str
+        :return: Host
+        :rtype: str
+        """
+        try:
+            hostname = urlsplit(CanonicalURL.canonicalize(url)).hostname or ""
+        except ValueError:
+            hostname = ""
+        matches = [
+            _d for _d in self.limits if hostname == _d or hostname.endswith(f".{_d}")
+        ]
+        if matches:
+            return max(matches, key=len)
+        return CanonicalURL.registrable_domain(url)
+
+    def put(self, url, item, priority=0, sequence=0):
+        """Queue <item> under the host of <url>.
+
+        :param url: URL of the video
+        :type url: str
+        :param item: What `get` returns
+        :type item: object
+        :param priority: Higher priorities are handed out first
+        :type priority: int
+        :param sequence: Orders items with the same priority, lowest first
+        :type sequence: int
+        """
+        host = self.host(url)
+        with self._condition:
+            if host not in self._queues:
+                self._queues[host] = []
+                self._rotation.append(host)
+            heapq.heappush(self._queues[host], (-priority, sequence, item))
+            self._unfinished += 1
+            self._condition.notify()
+
+    def get(self):
+        """Wait for an item whose host is allowed to start a download.
+
+        :return: Host and item, (None, None) once the scheduler is closed
+        :rtype: tuple
+        """
+        with self._condition:
+            while True:
+                if self._closed:
+                    return None, None
+                host, wait = self._next_host()
+                if host:
+                    break
+                self._condition.wait(timeout=wait)
+            _, _, item = heapq.heappop(self._queues[host])
+            self._rotation.remove(host)
+            if self._queues[host]:
+                self._rotation.append(host)  # Its turn is over.
+            else:
+                del self._queues[host]
+            self._active[host] = self._active.get(host, 0) + 1
+            self._next_start[host] = time.monotonic() + self._limit(host)[1]
+            return host, item
+
+    def release(self, host):
+        """A download for <host> has finished.
+
+        :param host: The host returned by `get`
+        :type host: str
+        """
+        with self._condition:
+            self._active[host] -= 1
+            if not self._active[host]:
+                del self._active[host]
+            self._unfinished -= 1
+            self._condition.notify_all()
+
+    def clear(self) -> list:
+        """Remove every queued item.
+
+        :return: The items
+        :rtype: list
+        """
+        with self._condition:
+            items = [_i for _q in self._queues.values() for _, _, _i in _q]
+            self._queues = {}
+            self._rotation.clear()
+            self._unfinished -= len(items)
+            self._condition.notify_all()
+        return items
+
+    def join(self):
+        """Wait until every item has been handed out and released."""
+        with self._condition:
+            while self._unfinished:
+                self._condition.wait()
+
+    def close(self):
+        """Make `get` return (None, None)."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def capacity(self, urls) -> int:
+        """How many of <urls> the limits allow to be downloaded at once.
+
+        :param urls: URLs of videos
+        :type urls: Iterable[str]
+        :return: Downloads
+        :rtype: int
+        """
+        hosts = {}
+        for url in urls:
+            host = self.host(url)
+            hosts[host] = hosts.get(host, 0) + 1
+        return sum(min(_n, self._limit(_h)[0]) for _h, _n in hosts.items())
+
+    def _limit(self, host) -> tuple:
+        return self.limits.get(host, (self.default_concurrency, self.default_spacing))
+
+    def _next_host(self):
+        """The host to take an item from, or how long to wait for one."""
+        now = time.monotonic()
+        best, wait = None, None
+        for host in self._rotation:
+            concurrency, _ = self._limit(host)
+            if self._active.get(host, 0) >= concurrency:
+                continue  # Woken by `release`.
+            next_start = self._next_start.get(host, 0)
+            if next_start > now:
+                wait = next_start - now if wait is None else min(wait, next_start - now)
+                continue
+            # Hosts are in turn order, a later host only wins with a higher priority.
+            if best is None or self._queues[host][0][0] < self._queues[best][0][0]:
+                best = host
+        return best, wait
@@ -2,6 +2,7 @@
 import logging
 from pathlib import Path
 
+from PinVidderer import metrics
 from PinVidderer.utils import Utils
 
 logger = logging.getLogger(__name__)
@@ -33,7 +34,8 @@ class Images:
         self._rename()
         self._convert_fanart()
         if self.configuration.get("pinvidderer", {}).get("create_poster"):
-            self._poster()
+            with metrics.poster_seconds.time():
+                self._poster()
 
     def _rename(self):
         image_formats = ["jpeg", "jpg", "png", "webp"]
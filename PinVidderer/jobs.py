@@ -0,0 +1,208 @@
+"""Download jobs."""
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from .utils import Utils
+
+logger = logging.getLogger(__name__)
+utils = Utils
+
+
+class JobQueue:
+    """Every bookmark or submitted URL being downloaded, and what has happened to it.
+
+    The watcher takes new jobs with `take_new` and downloads them, `Video` and `YouTubeDLer` move them through
+    the states. With a <queue_path> the jobs are saved on every change, jobs that hadn't finished when the
+    daemon stopped are pending again on the next start. Finished jobs are forgotten after `keep_seconds`.
+    """
+
+    states = [
+        "pending",
+        "fetching-metadata",
+        "downloading",
+        "post-processing",
+        "finalizing",
+        "done",
+        "skipped",
+        "failed",
+    ]
+    finished_states = ["done", "skipped", "failed"]
+    keep_seconds = 86400
+
+    def __init__(self, queue_path=None):
+        """
+        :param queue_path: Path to save the jobs to, None keeps them in memory
+        :type queue_path: Path
+        """
+        self.queue_path = Path(queue_path) if queue_path else None
+        self._jobs = {}
+        self._by_url = {}
+        self._new = []
+        self._lock = threading.Lock()
+        self._batch_depth = 0
+        self._dirty = False
+        self._load()
+
+    def add(self, url, description="", priority=0, bookmark=None) -> dict:
+        """Submit a URL. A URL that already has an unfinished job isn't submitted twice.
+
+        :param url: URL of the video
+        :type url: str
+        :param description: Used as the bookmark description, defaults to <url>
+        :type description: str
+        :param priority: Higher priorities are downloaded first
+        :type priority: int
+        :param bookmark: The Pinboard bookmark for <url>, a bookmark is mocked if not provided
+        :type bookmark: dict
+        :return: The job
+        :rtype: dict
+        """
+        with self._lock:
+            self._prune()
+            existing = self._jobs.get(self._by_url.get(url))
+            if existing and existing["state"] not in self.finished_states:
+                return dict(existing)
+            now = time.time()
+            job = {
+                "id": uuid.uuid4().hex,
+                "url": url,
+                "description": description or url,
+                "priority": int(priority),
+                "state": "pending",
+                "error": "",
+                "created": now,
+                "updated": now,
+            }
+            job["bookmark"] = bookmark or {"href": url, "description": job["description"]}
+            self._jobs[job["id"]] = job
+            self._by_url[url] = job["id"]
+            self._new.append(job["bookmark"])
+            self._save()
+            logger.debug(f'Job {job["id"]} submitted: {url}')
+            return dict(job)
+
+    @contextmanager
+    def batch(self):
+        """Save once at the end of the block instead of on every change."""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if not self._batch_depth and self._dirty:
+                    self._save()
+
+    def take_new(self) -> list:
+        """Bookmarks for the jobs submitted since the last call, or left unfinished by the last run.
+
+        :return: Bookmarks
+        :rtype: list
+        """
+        with self._lock:
+            new, self._new = self._new, []
+        return new
+
+    def get(self, job_id):
+        """Get a job.
+
+        :param job_id: The job's id
+        :type job_id: str
+        :return: The job, None if there isn't one
+        :rtype: dict
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def all(self) -> list:
+        """Every job, oldest first.
+
+        :return: Jobs
+        :rtype: list
+        """
+        with self._lock:
+            return [dict(_j) for _j in self._jobs.values()]
+
+    def priority(self, url) -> int:
+        """The priority of the job for <url>, 0 if there isn't one.
+
+        :param url: URL of the video
+        :type url: str
+        :rtype: int
+        """
+        with self._lock:
+            job = self._jobs.get(self._by_url.get(url))
+            return job["priority"] if job else 0
+
+    def finished(self, url) -> bool:
+        """Is there no unfinished job for <url>?
+
+        :param url: URL of the video
+        :type url: str
+        :rtype: bool
+        """
+        with self._lock:
+            job = self._jobs.get(self._by_url.get(url))
+            return not job or job["state"] in self.finished_states
+
+    def update(self, url, state, error=""):
+        """Move the job for <url> to <state>. Does nothing if there isn't a job for <url>.
+
+        :param url: URL of the video
+        :type url: str
+        :param state: One of `states`
+        :type state: str
+        :param error: Why the job failed
+        :type error: str
+        """
+        with self._lock:
+            job = self._jobs.get(self._by_url.get(url))
+            if not job or (job["state"] == state and not error):
+                return
+            job["state"] = state
+            job["error"] = str(error)
+            job["updated"] = time.time()
+            self._save()
+        logger.debug(f'Job {job["id"]} is {state}.')
+
+    def _load(self):
+        if not self.queue_path or not self.queue_path.exists():
+            return
+        try:
+            with open(self.queue_path, "r") as file:
+                self._jobs = json.load(file)
+        except json.JSONDecodeError:
+            logger.warning(f"Ignoring corrupt job queue {self.queue_path}.")
+            return
+        resumed = 0
+        for job in sorted(self._jobs.values(), key=lambda _j: _j["created"]):
+            self._by_url[job["url"]] = job["id"]
+            if job["state"] not in self.finished_states:
+                job["state"] = "pending"
+                self._new.append(job["bookmark"])
+                resumed += 1
+        if resumed:
+            logger.info(f"Resuming {resumed} unfinished job(s).")
+
+    def _save(self):
+        if self._batch_depth:
+            self._dirty = True
+            return
+        self._dirty = False
+        if self.queue_path:
+            utils.write_json_atomic(self.queue_path, self._jobs)
+
+    def _prune(self):
+        cutoff = time.time() - self.keep_seconds
+        for job_id, job in list(self._jobs.items()):
+            if job["state"] in self.finished_states and job["updated"] < cutoff:
+                del self._jobs[job_id]
+                if self._by_url.get(job["url"]) == job_id:
+                    del self._by_url[job["url"]]
@@ -0,0 +1,172 @@
+"""Disk space and the library quota."""
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from .custom_exceptions import InsufficientDiskSpace
+from .utils import Utils
+from .youtubedler import YouTubeDLer
+
+logger = logging.getLogger(__name__)
+utils = Utils
+
+# Room promised to downloads in progress, shared by every worker.
+_reservations = {}
+_reservations_lock = threading.Lock()
+
+
+class Library:
+    """The download directory, a directory per video with its NFO and images.
+
+    Before a download starts `admit` checks its expected size against the free disk space, less MIN FREE SPACE
+    and the room other downloads in progress expect to need. With a LIBRARY QUOTA videos are evicted to make
+    room, oldest or least recently watched first, both to stay under the quota and to free disk space.
+    Evicted videos stay in the history, marked as evicted, so they aren't downloaded again.
+    """
+
+    eviction_orders = ["oldest", "least-watched"]
+
+    def __init__(self, configuration, history):
+        """
+        :param configuration: The PinVidderer configuration
+        :type configuration: dict
+        :param history: The history, evictions are recorded in it
+        :type history: History
+        """
+        _pinvidderer = configuration.get("pinvidderer", {})
+        self.download_path = Path(_pinvidderer.get("download_path"))
+        self.work_path = self.download_path.joinpath(YouTubeDLer.work_dir_name)
+        self.min_free_space = utils.parse_bytes(_pinvidderer.get("min_free_space", "1G"))
+        self.quota = utils.parse_bytes(_pinvidderer.get("library_quota", 0))
+        self.eviction_order = _pinvidderer.get("eviction_order", "oldest")
+        if self.eviction_order not in self.eviction_orders:
+            logger.error(f"Unknown EVICTION ORDER {self.eviction_order}, using oldest.")
+            self.eviction_order = "oldest"
+        self.history = history
+
+    def admit(self, url, expected_size):
+        """Reserve room for a download, evicting videos if there's a quota and not enough room.
+
+        :param url: URL of the video
+        :type url: str
+        :param expected_size: Expected size in bytes, infinity if it's unknown
+        :type expected_size: float
+        :raises InsufficientDiskSpace: There isn't room, the download shouldn't start
+        """
+        needed = 0 if expected_size == float("inf") else int(expected_size)
+        # Held while evicting, so two downloads don't evict for the same room.
+        with _reservations_lock:
+            _reservations.pop(url, None)
+            reserved = sum(_reservations.values())
+            room, reason = self._room()
+            if needed > room - reserved and self.quota:
+                self._evict(needed - room + reserved, reason)
+                room, _ = self._room()
+            if needed > room - reserved:
+                raise InsufficientDiskSpace(url, needed=needed, available=max(room - reserved, 0))
+            _reservations[url] = needed
+        logger.debug(f"Admitted {url}, expecting {utils.format_bytes(needed)}.")
+
+    @staticmethod
+    def release(url):
+        """The download for <url> has finished, free its reservation.
+
+        :param url: URL of the video
+        :type url: str
+        """
+        with _reservations_lock:
+            _reservations.pop(url, None)
+
+    def _room(self):
+        """Bytes that can be downloaded, and the limit that's closest.
+
+        :return: Bytes, "disk space" or "library quota"
+        :rtype: int, str
+        """
+        room = shutil.disk_usage(self.download_path).free - self.min_free_space
+        reason = "disk space"
+        if self.quota:
+            quota_room = self.quota - self._size(self.download_path, skip=self.work_path)
+            if quota_room < room:
+                room, reason = quota_room, "library quota"
+        return room, reason
+
+    def _evict(self, needed, reason) -> int:
+        """Evict videos until <needed> bytes have been freed, or there's nothing left to evict.
+
+        :param needed: Bytes to free
+        :type needed: int
+        :param reason: Why, recorded in the history
+        :type reason: str
+        :return: Bytes freed
+        :rtype: int
+        """
+        candidates = []
+        for video_file, events in self._candidates():
+            video_dir = video_file.parent
+            if video_dir != self.download_path and self.download_path in video_dir.parents:
+                files = [video_dir]
+                size = self._size(video_dir)
+            else:
+                # Not in a directory of its own, just the video and the NFO next to it.
+                files = [_f for _f in video_dir.glob(f"{video_file.stem}.*") if _f.is_file()]
+                size = sum(_f.stat().st_size for _f in files)
+            candidates.append((video_file, events, files, size))
+        if sum(_c[3] for _c in candidates) < needed:
+            logger.warning(f"Evicting every video wouldn't free {utils.format_bytes(needed)}, not evicting any.")
+            return 0
+        freed = 0
+        for video_file, events, files, size in candidates:
+            if freed >= needed:
+                break
+            for file in files:
+                if file.is_dir():
+                    utils.remove_dir(file)
+                else:
+                    file.unlink()
+            freed += size
+            logger.warning(f"Evicted {video_file} for {reason}, freed {utils.format_bytes(size)}.")
+            for event in events:
+                self.history.mark_evicted(event, reason=reason)
+        return freed
+
+    def _candidates(self) -> list:
+        """Downloaded videos still on disk, in eviction order.
+
+        :return: (video file, every event for it) tuples
+        :rtype: list
+        """
+        videos = {}
+        for event in self.history.get():
+            if not event["downloadCompleted"] or event.get("evicted") or not event["videoFile"]:
+                continue
+            videos.setdefault(event["videoFile"], []).append(event)
+        candidates = []
+        for video_file, events in videos.items():
+            try:
+                stat = os.stat(video_file)
+            except FileNotFoundError:
+                continue
+            if self.eviction_order == "least-watched":
+                key = stat.st_atime
+            else:
+                key = min(_e.get("downloadedAt", _e["dateTime"]) for _e in events)
+            candidates.append((key, Path(video_file), events))
+        candidates.sort(key=lambda _c: _c[0])
+        return [(_video_file, _events) for _, _video_file, _events in candidates]
+
+    @staticmethod
+    def _size(path, skip=None) -> int:
+        """Total size of the files under <path>, except those under <skip>."""
+        size = 0
+        for root, dirs, files in os.walk(path):
+            if skip is not None:
+                dirs[:] = [_d for _d in dirs if Path(root).joinpath(_d) != skip]
+            for name in files:
+                try:
+                    size += os.lstat(os.path.join(root, name)).st_size
+                except FileNotFoundError:
+                    pass
+        return size
@@ -0,0 +1,128 @@
+"""Get video metadata before downloading."""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import youtube_dl
+
+from .youtubedler import YouTubeDLer
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataPrefetcher:
+    """Resolve youtube-dl info dicts for many bookmarks at once, without downloading anything.
+
+    With the info dicts bookmarks for the same video are caught before downloading, the queue can be ordered
+    shortest first and URLs youtube-dl can't handle go to the history without using any bandwidth.
+    """
+
+    def __init__(self, configuration, history, workers=4):
+        """
+        :param configuration: The PinVidderer configuration
+        :type configuration: dict
+        :param history: The history, failures are added to it
+        :type history: History
+        :param workers: Number of info dicts to resolve at once
+        :type workers: int
+        """
+        self.configuration = configuration
+        self.history = history
+        self.workers = max(int(workers), 1)
+        self._local = threading.local()
+        self._youtubedlers = []
+        self._youtubedlers_lock = threading.Lock()
+
+    def prefetch(self, bookmarks) -> tuple:
+        """Get the info dict for every bookmark.
+
+        :param bookmarks: Pinboard.in bookmarks
+        :type bookmarks: list
+        :return: (bookmark, info dict) tuples, de-duplicated and ordered smallest first. The bookmarks left out as
+            the same video as another, (bookmark, info dict, URL of the other bookmark) tuples
+        :rtype: list, list
+        """
+        if not bookmarks:
+            return [], []
+        with ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="PinVidderer-metadata"
+        ) as executor:
+            results = list(executor.map(self._get_info, bookmarks))
+        self.close()
+        prefetched = []
+        duplicates = []
+        seen = {}
+        for bookmark, info in zip(bookmarks, results):
+            if info is False:
+                continue
+            if info is None:
+                prefetched.append((bookmark, None))
+                continue
+            video_key = (info.get("extractor_key"), info.get("id"))
+            if video_key in seen:
+                logger.info(
+                    f'Holding back {bookmark["href"]}, it is the same video as {seen[video_key]}.'
+                )
+                duplicates.append((bookmark, info, seen[video_key]))
+                continue
+            seen[video_key] = bookmark["href"]
+            prefetched.append((bookmark, info))
+        prefetched.sort(key=lambda _p: self.expected_size(_p[1]))
+        return prefetched, duplicates
+
+    def close(self):
+        """Close the youtube-dl instances."""
+        with self._youtubedlers_lock:
+            for _youtubedler in self._youtubedlers:
+                _youtubedler.close()
+            self._youtubedlers = []
+        self._local = threading.local()
+
+    @staticmethod
+    def expected_size(info) -> float:
+        """Estimate how large the download will be.
+
+        :param info: youtube-dl info dict
+        :type info: dict
+        :return: Expected size in bytes. Infinity if it can't be estimated
+        :rtype: float
+        """
+        if not info:
+            return float("inf")
+        formats = info.get("requested_formats") or [info]
+        sizes = [_f.get("filesize") or _f.get("filesize_approx") for _f in formats]
+        if all(sizes):
+            return float(sum(sizes))
+        if info.get("duration"):
+            # Sort unsized videos by duration at a nominal 1MiB per second.
+            return float(info["duration"]) * 1024 * 1024
+        return float("inf")
+
+    def _get_info(self, bookmark):
+        """Get the info dict for a bookmark, failures are added to the history.
+
+        :param bookmark: Pinboard.in bookmark
+        :type bookmark: dict
+        :return: The info dict. False if youtube-dl can't get the video, None if the metadata is unavailable
+        :rtype: dict, bool, None
+        """
+        youtubedler = getattr(self._local, "youtubedler", None)
+        if youtubedler is None:
+            youtubedler = YouTubeDLer(configuration=self.configuration)
+            self._local.youtubedler = youtubedler
+            with self._youtubedlers_lock:
+                self._youtubedlers.append(youtubedler)
+        try:
+            return youtubedler.get_info(bookmark["href"])
+        except youtube_dl.utils.YoutubeDLError as err:
+            self.history.add(
+                url=bookmark["href"],
+                description=bookmark["description"],
+                download_completed=False,
+                error=err,
+            )
+            return False
+        except Exception as err:
+            # Leave it to the download to fail, or not.
+            logger.warning(f'Could not get metadata for {bookmark["href"]}: {err}')
+            return None
@@ -0,0 +1,224 @@
+"""Prometheus style metrics.
+
+Recording is a dict update under a per-metric lock, cheap enough for the download and Pinboard hot paths.
+The metrics are only served if [METRICS] ENABLED is set.
+"""
+import bisect
+import threading
+import time
+
+
+class _Metric:
+    """A named metric, one value (or set of buckets) per combination of label values."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(_l, "")) for _l in self.labels)
+
+    def _format_labels(self, key, extra=None):
+        pairs = list(zip(self.labels, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        escaped = [
+            (_k, _v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for _k, _v in pairs
+        ]
+        return "{" + ",".join(f'{_k}="{_v}"' for _k, _v in escaped) + "}"
+
+    def render(self) -> list:
+        """The metric in the Prometheus text format.
+
+        :return: Lines
+        :rtype: list
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value) -> list:
+        return [f"{self.name}{self._format_labels(key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        """Add <amount> to the counter for <labels>."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._function = None
+
+    def set(self, value, **labels):
+        """Set the gauge for <labels>."""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        """Get the (unlabelled) value from <function> whenever the metric is rendered.
+
+        :param function: Returns the current value
+        :type function: callable
+        """
+        self._function = function
+
+    def render(self) -> list:
+        if self._function:
+            self.set(self._function())
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        super().__init__(name, documentation, labels)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, **labels):
+        """Count <value> in its bucket for <labels>."""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def time(self, **labels):
+        """Observe how long a `with` block takes, in seconds."""
+        return _Timer(self, labels)
+
+    def _render_value(self, key, value) -> list:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + [float("inf")], counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            lines.append(f'{self.name}_bucket{self._format_labels(key, ("le", le))} {cumulative}')
+        lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+        lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._histogram.observe(time.monotonic() - self._started, **self._labels)
+
+
+class MetricsRegistry:
+    """Every metric, rendered together for the `/metrics` endpoint."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        """Add a metric, returns it."""
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text format.
+
+        :return: The exposition
+        :rtype: str
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+_MiB = 1024 * 1024
+
+registry = MetricsRegistry()
+
+download_bytes = registry.register(
+    Histogram(
+        "pinvidderer_download_bytes",
+        "Size of downloaded videos.",
+        buckets=[_MiB * 2 ** _e for _e in range(0, 15, 2)],
+    )
+)
+download_seconds = registry.register(
+    Histogram(
+        "pinvidderer_download_seconds",
+        "Time spent downloading a video.",
+        buckets=[1, 5, 15, 30, 60, 300, 900, 1800, 3600, 7200, 14400],
+    )
+)
+download_rate = registry.register(
+    Histogram(
+        "pinvidderer_download_rate_bytes_per_second",
+        "Average download rate of a video.",
+        buckets=[_MiB / 16 * 2 ** _e for _e in range(0, 12)],
+    )
+)
+pinboard_request_seconds = registry.register(
+    Histogram(
+        "pinvidderer_pinboard_request_seconds",
+        "Pinboard API latency, including retries.",
+        buckets=[0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300],
+        labels=["endpoint"],
+    )
+)
+pinboard_retries = registry.register(
+    Counter(
+        "pinvidderer_pinboard_retries_total",
+        "Pinboard API requests retried.",
+        labels=["endpoint"],
+    )
+)
+history_write_seconds = registry.register(
+    Histogram(
+        "pinvidderer_history_write_seconds",
+        "Time taken to write a history event.",
+        buckets=[0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1],
+    )
+)
+poster_seconds = registry.register(
+    Histogram(
+        "pinvidderer_poster_seconds",
+        "Time taken to create a poster from the fanart.",
+        buckets=[0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30],
+    )
+)
+queue_depth = registry.register(
+    Gauge("pinvidderer_queue_depth", "Bookmarks queued or downloading.")
+)
+failures = registry.register(
+    Counter(
+        "pinvidderer_failures_total",
+        "Failed downloads by error class.",
+        labels=["error"],
+    )
+)
@@ -0,0 +1,146 @@
+"""Pinboard bookmark updates waiting to be made."""
+import json
+import logging
+import random
+import threading
+import time
+from pathlib import Path
+
+from .utils import Utils
+
+logger = logging.getLogger(__name__)
+utils = Utils
+
+
+class Outbox:
+    """A persistent queue of bookmark updates, drained in the background.
+
+    Downloads add the bookmark and move on, a single thread makes the updates at whatever rate the Pinboard
+    rate limit allows. Failed updates are retried with backoff, the queue is saved after every change so it
+    survives restarts.
+    """
+
+    retry_base = 60  # Seconds
+    retry_max = 3600
+
+    def __init__(self, outbox_path, apply):
+        """
+        :param outbox_path: Path to the outbox file
+        :type outbox_path: Path
+        :param apply: Makes the update for a bookmark, returns False if it failed
+        :type apply: callable
+        """
+        self.outbox_path = Path(outbox_path)
+        self._apply = apply
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._load()
+
+    def add(self, bookmark):
+        """Queue an update for a bookmark.
+
+        :param bookmark: A bookmark
+        :type bookmark: dict
+        """
+        with self._lock:
+            self._entries[bookmark["href"]] = {
+                "bookmark": bookmark,
+                "attempts": 0,
+                "nextAttempt": 0,
+            }
+            self._save()
+        self._wake.set()
+
+    def contains(self, url) -> bool:
+        """Is an update for <url> waiting to be made?
+
+        :param url: Bookmark URL
+        :type url: str
+        :rtype: bool
+        """
+        with self._lock:
+            return url in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def start(self):
+        """Start draining in the background."""
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._drain, name="PinVidderer-outbox", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop draining, waiting for an update in progress to finish.
+
+        :param timeout: Seconds to wait
+        :type timeout: float
+        """
+        self._stopping.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def drain_once(self) -> float:
+        """Make every update that's due.
+
+        :return: Seconds until the next update is due, None if the outbox is empty
+        :rtype: float
+        """
+        with self._lock:
+            due = [
+                _e for _e in self._entries.values() if _e["nextAttempt"] <= time.time()
+            ]
+        for entry in due:
+            if self._stopping.is_set():
+                break
+            bookmark = entry["bookmark"]
+            try:
+                done = self._apply(bookmark)
+            except Exception as err:
+                logger.error(f'Error updating "{bookmark["description"]}": {err}')
+                done = False
+            with self._lock:
+                if done:
+                    self._entries.pop(bookmark["href"], None)
+                else:
+                    entry["attempts"] += 1
+                    delay = min(self.retry_max, self.retry_base * 2 ** entry["attempts"])
+                    entry["nextAttempt"] = time.time() + random.uniform(delay / 2, delay)
+                    logger.warning(
+                        f'Updating "{bookmark["description"]}" failed, attempt {entry["attempts"]}. '
+                        f'Retrying at {time.ctime(entry["nextAttempt"])}.'
+                    )
+                self._save()
+        with self._lock:
+            if not self._entries:
+                return None
+            return max(min(_e["nextAttempt"] for _e in self._entries.values()) - time.time(), 0)
+
+    def _drain(self):
+        while not self._stopping.is_set():
+            wait = self.drain_once()
+            self._wake.wait(timeout=wait)
+            self._wake.clear()
+
+    def _load(self):
+        if not self.outbox_path.exists():
+            return
+        try:
+            with open(self.outbox_path, "r") as file:
+                self._entries = json.load(file)
+        except json.JSONDecodeError:
+            logger.warning(f"Ignoring corrupt outbox {self.outbox_path}.")
+            return
+        if self._entries:
+            logger.info(f"{len(self._entries)} bookmark update(s) waiting in the outbox.")
+
+    def _save(self):
+        utils.write_json_atomic(self.outbox_path, self._entries)
@@ -1,12 +1,27 @@
 """Manage Pinboard.in."""
+import json
 import logging
+import threading
+import time
+from pathlib import Path
 
 from PinVidderer.do_http import DoHTTP
 
-from .utils import DateTimeFormatter
+from .outbox import Outbox
+from .ratelimit import TokenBucket
+from .utils import DateTimeFormatter, Utils
 
 logger = logging.getLogger(__name__)
 dtf = DateTimeFormatter()
+utils = Utils
+
+# Pinboard allows one call every 3 seconds, posts/all every 5 minutes and posts/recent every minute.
+# Shared by every Pinboard client in the process. The default interval is replaced by [HTTP] RATE LIMIT SECONDS.
+_rate_limits = {
+    "/v1/": TokenBucket(interval=3),
+    "/v1/posts/all": TokenBucket(interval=300),
+    "/v1/posts/recent": TokenBucket(interval=60),
+}
 
 
 class Pinboard:
@@ -14,51 +29,175 @@ class Pinboard:
         self.configuration = configuration
         self.token = self.configuration.get("auth", {}).get("pinboard_token")
         self.endpoint = "https://api.pinboard.in"
-        self.do_http = DoHTTP(method="GET", endpoint=self.endpoint, token=self.token)
+        http = self.configuration.get("http", {})
+        self.do_http = DoHTTP(
+            method="GET",
+            endpoint=self.endpoint,
+            token=self.token,
+            pool_connections=http.get("pool_connections", 1),
+            pool_maxsize=http.get("pool_maxsize", 4),
+            pool_block=http.get("pool_block", True),
+            keep_alive=http.get("keep_alive", True),
+            rate_limits=_rate_limits,
+            max_retries=http.get("max_retries", 5),
+            backoff_base=http.get("backoff_base", 2),
+            backoff_max=http.get("backoff_max", 60),
+        )
+        _rate_limits["/v1/"].interval = float(http.get("rate_limit_seconds", 3))
+        # Bookmark updates are read-modify-write, only one at a time.
+        self._update_lock = threading.Lock()
+        config_dir = self.configuration.get("dev", {}).get("config_dir", "~/.pinvidderer")
+        cache_file = self.configuration.get("dev", {}).get(
+            "bookmark_cache_file", "bookmarks.json"
+        )
+        outbox_file = self.configuration.get("dev", {}).get("outbox_file", "outbox.json")
+        self.cache = BookmarkCache(
+            cache_path=utils.expand_path(config_dir).joinpath(cache_file)
+        )
+        self.outbox = Outbox(
+            outbox_path=utils.expand_path(config_dir).joinpath(outbox_file),
+            apply=self.apply_update,
+        )
 
-    def get_bookmarks(self, tag):
+    def get_bookmarks(self, tag, fromdt=None, max_wait=None):
         """Get bookmarks from Pinboard.
 
         :param tag: Tag to search for
         :type tag: str
+        :param fromdt: Only bookmarks created after this time, as "2021-03-01T00:00:00Z"
+        :type fromdt: str
+        :param max_wait: Raise `RateLimited` rather than wait longer than this for the rate limit
+        :type max_wait: float
         :return: Bookmarks
         :rtype: dict
         """
         _path = "/v1/posts/all"
-        _params = {"format": "json", "tag": tag}
-        _response = self.do_http.request(path=_path, params=_params, do_raise=False)
-        if _response.status_code == 200:
+        _params = {"format": "json", "tag": tag, "meta": "yes"}
+        if fromdt:
+            _params["fromdt"] = fromdt
+        _response = self.do_http.request(
+            path=_path, params=_params, do_raise=False, max_wait=max_wait
+        )
+        if _response is not None and _response.status_code == 200:
             return _response.json()
-        logger.error(
-            f"  Error getting get_bookmarks: {_response.text}, {_response.status_code}."
+        if _response is not None:
+            logger.error(
+                f"  Error getting get_bookmarks: {_response.text}, {_response.status_code}."
+            )
+        return False
+
+    def get_recent_bookmarks(self, tag, count=100, max_wait=None):
+        """Get the most recent bookmarks from Pinboard.
+
+        :param tag: Tag to search for
+        :type tag: str
+        :param count: Number of bookmarks, Pinboard returns at most 100
+        :type count: int
+        :param max_wait: Raise `RateLimited` rather than wait longer than this for the rate limit
+        :type max_wait: float
+        :return: Bookmarks, newest first
+        :rtype: list
+        """
+        _path = "/v1/posts/recent"
+        _params = {"format": "json", "tag": tag, "count": count, "meta": "yes"}
+        _response = self.do_http.request(
+            path=_path, params=_params, do_raise=False, max_wait=max_wait
         )
+        if _response is not None and _response.status_code == 200:
+            return _response.json().get("posts", [])
+        if _response is not None:
+            logger.error(
+                f"  Error getting recent bookmarks: {_response.text}, {_response.status_code}."
+            )
         return False
 
+    def sync_bookmarks(self, tag, full=False, max_wait=None) -> list:
+        """Get the bookmarks that are new or changed since the last sync.
+
+        An incremental sync asks posts/recent (allowed every minute, a wake doesn't have to wait for posts/all)
+        for the bookmarks created since the newest one already seen. Only if all of the 100 it returns are new is
+        posts/all asked for the rest, from the newest one already seen. A full sync gets the entire tagged set.
+        Either way a bookmark is only returned if its "meta" signature isn't in the local cache. A full sync is
+        also done if the cache is older than [PINVIDDERER] FULL SYNC INTERVAL, that picks up older bookmarks that
+        were tagged later.
+
+        :param tag: Tag to search for
+        :type tag: str
+        :param full: Force a full sync
+        :type full: bool
+        :param max_wait: Raise `RateLimited` rather than wait longer than this for the rate limit
+        :type max_wait: float
+        :return: New or changed bookmarks
+        :rtype: list
+        """
+        full_sync_interval = int(
+            self.configuration.get("pinvidderer", {}).get("full_sync_interval", 86400)
+        )
+        if self.configuration.get("pinvidderer", {}).get("sync", "incremental") != "incremental":
+            full = True
+        if time.time() - self.cache.last_full_sync > full_sync_interval:
+            full = True
+        fromdt = None if full else self.cache.cursor
+        logger.debug(f"Syncing bookmarks, full: {full}, from: {fromdt}.")
+        if not full and fromdt:
+            count = 100
+            recent = self.get_recent_bookmarks(tag, count=count, max_wait=max_wait)
+            if recent is False:
+                return []
+            bookmarks = [_b for _b in recent if _b.get("time", "") >= fromdt]
+            if len(recent) < count or len(bookmarks) < len(recent):
+                return self.cache.update(bookmarks)
+            logger.debug(f"More than {count} new bookmarks, getting the rest from posts/all.")
+        bookmarks = self.get_bookmarks(tag, fromdt=fromdt, max_wait=max_wait)
+        if bookmarks is False:
+            return []
+        return self.cache.update(bookmarks, full=full)
+
     def update_bookmarks(self, bookmark):
-        """Update bookmarks
+        """Queue the update of a bookmark in the outbox, it's made in the background by `apply_update`.
+
         :param bookmark: A bookmark
         :type bookmark: dict
         """
         if "tags" not in bookmark:
             logger.debug("Using a mocked bookmark, to tags to manage.")
             return True
+        self.outbox.add(bookmark)
+        return True
+
+    def apply_update(self, bookmark) -> bool:
+        """Remove the source tag from, or delete, a bookmark. Waits for the rate limit.
+
+        :param bookmark: A bookmark
+        :type bookmark: dict
+        :return: Was the bookmark updated?
+        :rtype: bool
+        """
         tag = self.configuration.get("pinvidderer", {}).get("source_tag")
         remove_tag = self.configuration.get("pinvidderer", {}).get("remove_tag")
         delete_bookmark = self.configuration.get("pinvidderer", {}).get(
             "delete_bookmark"
         )
-        if delete_bookmark:
-            if not self.delete_bookmark(bookmark):
-                self.remove_tag(bookmark, tag)
-        elif remove_tag:
-            self.remove_tag(bookmark, tag)
-        return True
+        with self._update_lock:
+            if delete_bookmark:
+                updated = self.delete_bookmark(bookmark) or self.remove_tag(
+                    bookmark, tag
+                )
+            elif remove_tag:
+                updated = self.remove_tag(bookmark, tag)
+            else:
+                updated = True
+        if updated:
+            self.cache.discard(bookmark)
+        return updated
 
-    def delete_bookmark(self, bookmark):
+    def delete_bookmark(self, bookmark, max_wait=None):
         """Delete a bookmark.
 
         :param bookmark: A Pinboard bookmark object.
         :type bookmark: dict
+        :param max_wait: Raise `RateLimited` rather than wait longer than this for the rate limit
+        :type max_wait: float
         """
         tags = bookmark["tags"].split(" ")
         if len(tags) > 1:
@@ -69,21 +208,27 @@ class Pinboard:
         logger.debug(f'  Deleting bookmark "{bookmark["description"]}"')
         _path = "/v1/posts/delete"
         _params = {"format": "json", "url": bookmark["href"]}
-        _response = self.do_http.request(path=_path, params=_params, do_raise=False)
+        _response = self.do_http.request(
+            path=_path, params=_params, do_raise=False, max_wait=max_wait
+        )
+        if _response is None:
+            return False
         if _response.status_code == 200:
             return True
         logger.error(
             f"  Error deleting bookmark: {_response.text}, {_response.status_code}."
         )
-        return True
+        return False
 
-    def remove_tag(self, bookmark, tag):
+    def remove_tag(self, bookmark, tag, max_wait=None):
         """Remove a tag from a Pinboard bookmark.
 
         :param bookmark: A Pinboard bookmark object
         :type bookmark: dict
         :param tag: A Pinboard tag
         :type tag: str
+        :param max_wait: Raise `RateLimited` rather than wait longer than this for the rate limit
+        :type max_wait: float
         """
         logger.debug(f'  Removing the "{tag}" tag.')
         _path = "/v1/posts/add"
@@ -100,8 +245,10 @@ class Pinboard:
         if _new_tags:
             _replacement_bookmark["tags"] = _new_tags
         _response = self.do_http.request(
-            path=_path, params=_replacement_bookmark, do_raise=False
+            path=_path, params=_replacement_bookmark, do_raise=False, max_wait=max_wait
         )
+        if _response is None:
+            return False
         if _response.status_code == 200:
             return True
         logger.error(
@@ -118,6 +265,97 @@ class Pinboard:
         _path = "/v1/posts/update"
         _params = {"format": "json"}
         _response = self.do_http.request(path=_path, params=_params, do_raise=False)
+        if _response is None or _response.status_code != 200:
+            logger.error("  Error getting the last update time, treating Pinboard as unchanged.")
+            return 0
         _json = _response.json()
         return dtf.epoch(_json["update_time"])
 
+
+class BookmarkCache:
+    """The tagged bookmarks seen so far and the sync cursor, kept on disk."""
+
+    def __init__(self, cache_path):
+        """
+        :param cache_path: Path to the cache file
+        :type cache_path: Path
+        """
+        self.cache_path = Path(cache_path)
+        self.cursor = None
+        self.last_full_sync = 0
+        self.bookmarks = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def update(self, bookmarks, full=False) -> list:
+        """Merge bookmarks from Pinboard into the cache.
+
+        :param bookmarks: Bookmarks from Pinboard
+        :type bookmarks: list
+        :param full: <bookmarks> is the entire tagged set, anything else in the cache is stale
+        :type full: bool
+        :return: Bookmarks that are new or have changed
+        :rtype: list
+        """
+        changed = []
+        with self._lock:
+            if full:
+                seen = {_b["href"] for _b in bookmarks}
+                self.bookmarks = {
+                    _h: _b for _h, _b in self.bookmarks.items() if _h in seen
+                }
+                self.last_full_sync = time.time()
+            for bookmark in bookmarks:
+                cached = self.bookmarks.get(bookmark["href"])
+                if not cached or cached.get("meta") != bookmark.get("meta"):
+                    changed.append(bookmark)
+                self.bookmarks[bookmark["href"]] = bookmark
+                # Pinboard times are ISO 8601 UTC strings, they sort lexically.
+                if bookmark.get("time") and (
+                    not self.cursor or bookmark["time"] > self.cursor
+                ):
+                    self.cursor = bookmark["time"]
+            self._save()
+        return changed
+
+    def all(self) -> list:
+        """Every cached bookmark.
+
+        :return: Bookmarks
+        :rtype: list
+        """
+        with self._lock:
+            return list(self.bookmarks.values())
+
+    def discard(self, bookmark):
+        """Forget a bookmark, it has been handled.
+
+        :param bookmark: A bookmark
+        :type bookmark: dict
+        """
+        with self._lock:
+            if self.bookmarks.pop(bookmark["href"], None):
+                self._save()
+
+    def _load(self):
+        if not self.cache_path.exists():
+            return
+        try:
+            with open(self.cache_path, "r") as file:
+                cache = json.load(file)
+        except json.JSONDecodeError:  # Corrupted, the next sync is a full sync.
+            logger.warning(f"Ignoring corrupt bookmark cache {self.cache_path}.")
+            return
+        self.cursor = cache.get("cursor")
+        self.last_full_sync = cache.get("lastFullSync", 0)
+        self.bookmarks = cache.get("bookmarks", {})
+
+    def _save(self):
+        utils.write_json_atomic(
+            self.cache_path,
+            {
+                "cursor": self.cursor,
+                "lastFullSync": self.last_full_sync,
+                "bookmarks": self.bookmarks,
+            },
+        )
@@ -0,0 +1,235 @@
+"""Live progress of in-flight downloads."""
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+from .custom_exceptions import DownloadStalled
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadProgress:
+    """Rolling rate and ETA for a single download, fed by the youtube-dl progress hook."""
+
+    sample_interval = 0.5  # Seconds between rate samples, the hook can fire thousands of times a second.
+
+    def __init__(self, url, description="", window=30.0, min_rate=0, stall_seconds=120):
+        """
+        :param url: URL of the video
+        :type url: str
+        :param description: Bookmark description
+        :type description: str
+        :param window: Seconds of samples the rate is calculated over
+        :type window: float
+        :param min_rate: Bytes per second below which a download is stalled, 0 disables stall detection
+        :type min_rate: int
+        :param stall_seconds: Seconds the rate has to stay below <min_rate> before the download is aborted
+        :type stall_seconds: float
+        """
+        self.url = url
+        self.description = description
+        self.window = float(window)
+        self.min_rate = int(min_rate)
+        self.stall_seconds = float(stall_seconds)
+        self.started = time.time()
+        self.filename = None
+        self.file_bytes = 0
+        self.file_total_bytes = None
+        self.completed_bytes = 0
+        self.rates = []
+        self._samples = deque()
+        self._below_min_rate_since = None
+        self._started_monotonic = time.monotonic()
+
+    @property
+    def downloaded_bytes(self) -> int:
+        """Bytes downloaded so far, across every file of the download."""
+        return self.completed_bytes + self.file_bytes
+
+    @property
+    def rate(self) -> float:
+        """Bytes per second over the rolling window."""
+        if len(self._samples) < 2:
+            return 0.0
+        (_t0, _b0), (_t1, _b1) = self._samples[0], self._samples[-1]
+        if _t1 <= _t0:
+            return 0.0
+        return (_b1 - _b0) / (_t1 - _t0)
+
+    @property
+    def eta(self):
+        """Seconds until the current file finishes, None if unknown."""
+        rate = self.rate
+        if not rate or not self.file_total_bytes:
+            return None
+        return max(self.file_total_bytes - self.file_bytes, 0) / rate
+
+    def update(self, status):
+        """Fold a youtube-dl progress hook status into the window.
+
+        :param status: youtube-dl progress status
+        :type status: dict
+        :raises DownloadStalled: The rate has been below the floor for too long
+        """
+        now = time.monotonic()
+        if status["status"] == "finished":
+            self.completed_bytes += status.get("downloaded_bytes") or status.get("total_bytes") or 0
+            self.file_bytes = 0
+            self.filename = None
+            return
+        if status["status"] != "downloading":
+            return
+        self.filename = status.get("filename")
+        self.file_bytes = status.get("downloaded_bytes") or 0
+        self.file_total_bytes = status.get("total_bytes") or status.get(
+            "total_bytes_estimate"
+        )
+        if self._samples and now - self._samples[-1][0] < self.sample_interval:
+            return
+        self._samples.append((now, self.downloaded_bytes))
+        while now - self._samples[0][0] > self.window:
+            self._samples.popleft()
+        rate = self.rate
+        self.rates.append(rate)
+        self._check_stalled(now, rate)
+
+    def _check_stalled(self, now, rate):
+        if not self.min_rate or now - self._started_monotonic < self.window:
+            return
+        if rate >= self.min_rate:
+            self._below_min_rate_since = None
+            return
+        if self._below_min_rate_since is None:
+            self._below_min_rate_since = now
+        elif now - self._below_min_rate_since >= self.stall_seconds:
+            raise DownloadStalled(
+                url=self.url, rate=rate, min_rate=self.min_rate, seconds=self.stall_seconds
+            )
+
+    def snapshot(self) -> dict:
+        """The current state of the download.
+
+        :return: Progress details
+        :rtype: dict
+        """
+        return {
+            "url": self.url,
+            "description": self.description,
+            "started": self.started,
+            "downloadedBytes": self.downloaded_bytes,
+            "fileTotalBytes": self.file_total_bytes,
+            "rate": self.rate,
+            "eta": self.eta,
+        }
+
+    @staticmethod
+    def percentile(values, pct) -> float:
+        """Nearest-rank percentile.
+
+        :param values: Samples
+        :type values: list
+        :param pct: Percentile, 0-100
+        :type pct: float
+        :return: The percentile, 0 if there are no samples
+        :rtype: float
+        """
+        if not values:
+            return 0.0
+        _sorted = sorted(values)
+        # The smallest value with at least <pct>% of the samples at or below it.
+        _rank = max(math.ceil(pct * len(_sorted) / 100) - 1, 0)
+        return float(_sorted[min(_rank, len(_sorted) - 1)])
+
+
+class ProgressRegistry:
+    """Every in-flight download, shared by all the workers."""
+
+    history_seconds = 86400  # Finished downloads are kept this long for throughput.
+
+    def __init__(self):
+        self._downloads = {}
+        self._stalls = {}
+        self._finished = deque()
+        self._lock = threading.Lock()
+        self.interrupted = threading.Event()
+
+    def start(self, url, **kwargs) -> DownloadProgress:
+        """Start tracking a download.
+
+        :param url: URL of the video
+        :type url: str
+        :param kwargs: Passed to `DownloadProgress`
+        :type kwargs: dict
+        :return: The download's progress
+        :rtype: DownloadProgress
+        """
+        progress = DownloadProgress(url, **kwargs)
+        with self._lock:
+            self._downloads[url] = progress
+        return progress
+
+    def finish(self, url):
+        """Stop tracking a download.
+
+        :param url: URL of the video
+        :type url: str
+        """
+        now = time.time()
+        with self._lock:
+            progress = self._downloads.pop(url, None)
+            if progress:
+                self._finished.append((now, progress.downloaded_bytes))
+            while self._finished and now - self._finished[0][0] > self.history_seconds:
+                self._finished.popleft()
+
+    def interrupt(self):
+        """Stop every in-flight download at its next progress update, see `DownloadInterrupted`."""
+        with self._lock:
+            downloading = len(self._downloads)
+        if downloading:
+            logger.warning(f"Interrupting {downloading} in-flight download(s).")
+        self.interrupted.set()
+
+    def stalled(self, url) -> int:
+        """Count a stall for <url>.
+
+        :param url: URL of the video
+        :type url: str
+        :return: The number of times <url> has stalled
+        :rtype: int
+        """
+        with self._lock:
+            self._stalls[url] = self._stalls.get(url, 0) + 1
+            return self._stalls[url]
+
+    def throughput(self, seconds) -> dict:
+        """Downloads finished in the last <seconds>.
+
+        :param seconds: Window, at most `history_seconds`
+        :type seconds: float
+        :return: Number of downloads, bytes and average bytes per second
+        :rtype: dict
+        """
+        since = time.time() - seconds
+        with self._lock:
+            finished = [_b for _t, _b in self._finished if _t >= since]
+        return {
+            "downloads": len(finished),
+            "bytes": sum(finished),
+            "rate": sum(finished) / seconds,
+        }
+
+    def snapshot(self) -> list:
+        """The state of every in-flight download.
+
+        :return: Progress details
+        :rtype: list
+        """
+        with self._lock:
+            downloads = list(self._downloads.values())
+        return [_d.snapshot() for _d in downloads]
+
+
+registry = ProgressRegistry()
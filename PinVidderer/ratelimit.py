@@ -0,0 +1,91 @@
+"""Rate limiting for API calls."""
+import logging
+import threading
+import time
+from contextlib import ExitStack
+
+from .custom_exceptions import RateLimited
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """A token bucket shared by every thread calling an endpoint family.
+
+    A token is reserved while holding the lock and the caller sleeps outside it, so waiting callers are served in
+    order. `pause` empties the bucket for a while, e.g. after a 429. `acquire_all` takes a token from several
+    buckets at once, for a call that counts against more than one limit.
+    """
+
+    def __init__(self, interval, burst=1):
+        """
+        :param interval: Seconds between calls
+        :type interval: float
+        :param burst: Calls allowed back to back after a quiet period
+        :type burst: int
+        """
+        self.interval = float(interval)
+        self.burst = int(burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait=None) -> float:
+        """Take a token, waiting for one if necessary.
+
+        :param max_wait: Raise rather than wait longer than this many seconds, None waits as long as it takes
+        :type max_wait: float
+        :return: Seconds waited
+        :rtype: float
+        :raises RateLimited: A token isn't available within <max_wait>
+        """
+        return self.acquire_all([self], max_wait=max_wait)
+
+    @staticmethod
+    def acquire_all(buckets, max_wait=None) -> float:
+        """Take a token from every one of <buckets>, waiting until they all have one.
+
+        Each token is reserved for the same moment, when the slowest bucket has one, so the call doesn't use up
+        an earlier slot in the others. Nothing is taken if it raises.
+
+        :param buckets: The buckets
+        :type buckets: list
+        :param max_wait: Raise rather than wait longer than this many seconds, None waits as long as it takes
+        :type max_wait: float
+        :return: Seconds waited
+        :rtype: float
+        :raises RateLimited: The tokens aren't available within <max_wait>
+        """
+        with ExitStack() as stack:
+            # Always locked in the same order, two callers with overlapping buckets can't deadlock.
+            buckets = sorted(set(buckets), key=id)
+            for bucket in buckets:
+                stack.enter_context(bucket._lock)
+                bucket._refill()
+            wait = max((max(1 - _b._tokens, 0) * _b.interval for _b in buckets), default=0)
+            if max_wait is not None and wait > max_wait:
+                raise RateLimited(retry_after=wait)
+            for bucket in buckets:
+                # May go negative, that is a reservation.
+                bucket._tokens = min(bucket._tokens, 1 - wait / bucket.interval) - 1
+        if wait:
+            logger.debug(f"Rate limited, waiting {wait:.1f} seconds.")
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        """Don't hand out tokens for <seconds>.
+
+        :param seconds: Seconds to pause for
+        :type seconds: float
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 1 - seconds / self.interval)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) / self.interval
+        )
+        self._updated = now
@@ -0,0 +1,126 @@
+"""When to retry failed downloads."""
+import logging
+import random
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy:
+    """Decide whether a failed download is retried, and when.
+
+    Failures caused by the network, the site or its CDN (timeouts, 5xx and 429 responses, truncated downloads,
+    stalls, geo-blocking) are retryable, the video is downloaded again after an exponential, jittered delay until
+    `max_attempts` have failed. Failures that won't go away (unsupported URLs, private or deleted videos, 404s)
+    are permanent.
+    """
+
+    retryable_http_codes = {403, 408, 429, 500, 502, 503, 504}
+    retryable_names = {
+        "ContentTooShortError",
+        "DownloadStalled",
+        "GeoRestrictedError",
+        "IncompleteRead",
+        "InsufficientDiskSpace",
+        "RemoteDisconnected",
+    }
+    permanent_names = {
+        "SameFileError",
+        "UnavailableVideoError",
+        "UnsupportedError",
+        "UnsupportedURL",
+    }
+    # youtube-dl wraps most errors in a DownloadError, often with only the message to go on.
+    retryable_messages = re.compile(
+        r"HTTP Error (5\d\d|403|408|429)|timed out|temporar|try again|connection (reset|refused|aborted)"
+        r"|too many requests|rate.?limit|geo.?restrict|not available (in|from) your (country|location)",
+        re.IGNORECASE,
+    )
+
+    def __init__(self, max_attempts=5, base_delay=600, max_delay=86400):
+        """
+        :param max_attempts: Give up after this many failed attempts
+        :type max_attempts: int
+        :param base_delay: Seconds before the first retry, doubled for each one after that
+        :type base_delay: float
+        :param max_delay: Most seconds between retries
+        :type max_delay: float
+        """
+        self.max_attempts = int(max_attempts)
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+
+    @classmethod
+    def from_config(cls, configuration):
+        """Build a policy from the [PINVIDDERER] section.
+
+        :param configuration: The PinVidderer configuration
+        :type configuration: dict
+        :return: The policy
+        :rtype: RetryPolicy
+        """
+        _pinvidderer = configuration.get("pinvidderer", {})
+        return cls(
+            max_attempts=_pinvidderer.get("retry_max_attempts", 5),
+            base_delay=_pinvidderer.get("retry_base_delay", 600),
+            max_delay=_pinvidderer.get("retry_max_delay", 86400),
+        )
+
+    def retryable(self, error) -> bool:
+        """Could the download work if it's tried again later?
+
+        :param error: Why the download failed
+        :type error: Exception, str
+        :rtype: bool
+        """
+        if not isinstance(error, BaseException):
+            return bool(self.retryable_messages.search(str(error)))
+        causes = self._causes(error)
+        for cause in causes:
+            names = {_c.__name__ for _c in type(cause).__mro__}
+            if names & self.permanent_names:
+                return False
+            if names & self.retryable_names:
+                return True
+            code = getattr(cause, "code", None)
+            if isinstance(code, int) and "HTTPError" in names:
+                return code in self.retryable_http_codes
+            if isinstance(cause, (TimeoutError, ConnectionError)) or "URLError" in names:
+                return True
+        if self.retryable_messages.search(" ".join(str(_c) for _c in causes)):
+            return True
+        if any(type(_c).__name__ == "ExtractorError" and not getattr(_c, "expected", True) for _c in causes):
+            return True  # The extractor broke, a youtube-dl update may fix it.
+        # Anything youtube-dl didn't raise, e.g. a full disk.
+        return not any(
+            "YoutubeDLError" in {_c.__name__ for _c in type(_e).__mro__} for _e in causes
+        )
+
+    def next_retry(self, attempts):
+        """When to retry after <attempts> failures.
+
+        :param attempts: Failed attempts so far
+        :type attempts: int
+        :return: Epoch time, None once `max_attempts` have failed
+        :rtype: float
+        """
+        if attempts >= self.max_attempts:
+            return None
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return time.time() + random.uniform(delay / 2, delay)
+
+    @staticmethod
+    def _causes(error) -> list:
+        """<error> and whatever caused it, outermost first."""
+        causes = []
+        while error is not None and error not in causes:
+            causes.append(error)
+            exc_info = getattr(error, "exc_info", None)  # youtube_dl DownloadError
+            if isinstance(exc_info, tuple) and len(exc_info) > 1 and isinstance(exc_info[1], BaseException):
+                error = exc_info[1]
+            elif isinstance(getattr(error, "cause", None), BaseException):  # youtube_dl ExtractorError
+                error = error.cause
+            else:
+                error = error.__cause__ or error.__context__
+        return causes
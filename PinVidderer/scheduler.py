@@ -0,0 +1,101 @@
+"""When the watcher polls Pinboard next."""
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """An interruptible, adaptive poll interval.
+
+    The interval drops to <min_interval> after activity and doubles each idle poll, up to <max_interval>.
+    `wake` ends the current wait early, it's called by SIGUSR1, the control endpoint and the inbox directory.
+    """
+
+    def __init__(self, min_interval, max_interval):
+        """
+        :param min_interval: Seconds between polls right after activity
+        :type min_interval: float
+        :param max_interval: Longest time between polls, in seconds
+        :type max_interval: float
+        """
+        self.max_interval = float(max_interval)
+        self.min_interval = min(float(min_interval), self.max_interval)
+        self.interval = self.min_interval
+        self._reason = None
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._inbox_thread = None
+
+    def activity(self):
+        """Something happened, poll again soon."""
+        self.interval = self.min_interval
+
+    def idle(self):
+        """Nothing happened, back off."""
+        self.interval = min(self.interval * 2, self.max_interval)
+
+    def wake(self, reason="trigger"):
+        """End the current wait, or the next one if the watcher is busy.
+
+        :param reason: Logged by the watcher
+        :type reason: str
+        """
+        self._reason = reason
+        self._wake.set()
+
+    def wait(self, seconds=None):
+        """Wait for the next poll.
+
+        :param seconds: Seconds to wait, defaults to the current interval
+        :type seconds: float
+        :return: Why the wait ended early, None if it timed out
+        :rtype: str
+        """
+        seconds = self.interval if seconds is None else min(seconds, self.max_interval)
+        woken = self._wake.wait(timeout=max(seconds, 0))
+        self._wake.clear()
+        reason, self._reason = self._reason, None
+        if woken:
+            self.activity()
+            return reason
+        return None
+
+    def watch_inbox(self, inbox_path, check_interval=1.0):
+        """Wake whenever a file is dropped into <inbox_path>. The file is removed.
+
+        :param inbox_path: Directory to watch, created if it doesn't exist
+        :type inbox_path: Path
+        :param check_interval: Seconds between checks
+        :type check_interval: float
+        """
+        inbox_path = Path(inbox_path)
+        inbox_path.mkdir(parents=True, exist_ok=True)
+        self._inbox_thread = threading.Thread(
+            target=self._watch_inbox,
+            args=(inbox_path, float(check_interval)),
+            name="PinVidderer-inbox",
+            daemon=True,
+        )
+        self._inbox_thread.start()
+        logger.info(f"Watching {inbox_path} for wakeups.")
+
+    def stop(self):
+        """Stop watching the inbox."""
+        self._stopping.set()
+        if self._inbox_thread:
+            self._inbox_thread.join()
+            self._inbox_thread = None
+
+    def _watch_inbox(self, inbox_path, check_interval):
+        while not self._stopping.wait(check_interval):
+            dropped = [_f for _f in inbox_path.iterdir() if _f.is_file()]
+            if not dropped:
+                continue
+            for _file in dropped:
+                try:
+                    _file.unlink()
+                except FileNotFoundError:
+                    pass
+            self.wake(f"inbox ({dropped[0].name})")
@@ -0,0 +1,121 @@
+"""Canonical URLs, so variants of a URL are recognized as the same video."""
+import logging
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+
+class CanonicalURL:
+    """Reduce a URL to a canonical form, used to index the history. Videos are still downloaded from the
+    bookmarked URL.
+
+    http becomes https, the host is lowercased, "www." and "m." are dropped from the host, as are default ports,
+    fragments, trailing slashes and tracking parameters. The remaining query parameters are sorted. YouTube
+    URLs (youtu.be, shorts, embeds, the mobile site) become https://youtube.com/watch?v=<id>, keeping a playlist
+    ("list" and "index"), youtube-dl downloads the whole playlist for those.
+    """
+
+    tracking_parameters = {
+        "fbclid",
+        "feature",
+        "gclid",
+        "igshid",
+        "mc_cid",
+        "mc_eid",
+        "ref_src",
+        "si",
+        "spm",
+    }
+    tracking_prefixes = ("utm_",)
+    host_prefixes = ("www.", "m.", "mobile.")
+    default_ports = {"http": 80, "https": 443}
+    youtube_hosts = {"youtube.com", "youtu.be", "youtube-nocookie.com", "music.youtube.com"}
+    youtube_id_paths = ("/shorts/", "/embed/", "/v/", "/live/")
+    youtube_playlist_parameters = {"list", "index"}
+    # Labels that country code TLDs register domains under, e.g. "bbc.co.uk".
+    second_level_labels = {"ac", "co", "com", "edu", "gov", "ne", "net", "or", "org"}
+
+    @classmethod
+    def canonicalize(cls, url) -> str:
+        """The canonical form of <url>, <url> itself if it can't be parsed.
+
+        :param url: A URL
+        :type url: str
+        :return: The canonical URL
+        :rtype: str
+        """
+        try:
+            parts = urlsplit(url.strip())
+            port = parts.port
+        except ValueError:
+            return url
+        scheme = parts.scheme.lower()
+        if scheme == "http":
+            scheme = "https"
+        host = (parts.hostname or "").lower()
+        for _prefix in cls.host_prefixes:
+            if host.startswith(_prefix):
+                host = host[len(_prefix):]
+                break
+        if ":" in host:  # IPv6
+            host = f"[{host}]"
+        if port and port != cls.default_ports.get(parts.scheme.lower()):
+            host = f"{host}:{port}"
+        query = [
+            (_k, _v)
+            for _k, _v in parse_qsl(parts.query, keep_blank_values=True)
+            if _k not in cls.tracking_parameters and not _k.startswith(cls.tracking_prefixes)
+        ]
+        if host in cls.youtube_hosts:
+            video_id = cls._youtube_id(host, parts.path, query)
+            if video_id:
+                playlist = [(_k, _v) for _k, _v in query if _k in cls.youtube_playlist_parameters]
+                return f"https://youtube.com/watch?{urlencode(sorted([('v', video_id)] + playlist))}"
+        path = parts.path.rstrip("/") or "/"
+        return urlunsplit((scheme, host, path, urlencode(sorted(query)), ""))
+
+    @classmethod
+    def host(cls, url) -> str:
+        """The host of the canonical form of <url>, "youtu.be" and "m.youtube.com" are both "youtube.com".
+
+        :param url: A URL
+        :type url: str
+        :return: The host, with the port if it isn't the default
+        :rtype: str
+        """
+        return urlsplit(cls.canonicalize(url)).netloc
+
+    @classmethod
+    def registrable_domain(cls, url) -> str:
+        """The domain the host of <url> is registered under, "news.bbc.co.uk" is "bbc.co.uk". Every YouTube
+        host, "youtu.be" included, is "youtube.com".
+
+        A guess without the public suffix list, good enough to group a site's hosts.
+
+        :param url: A URL
+        :type url: str
+        :return: The domain, without the port. IP addresses are returned as they are
+        :rtype: str
+        """
+        try:
+            host = urlsplit(cls.canonicalize(url)).hostname or ""
+        except ValueError:
+            return ""
+        labels = host.split(".")
+        if ":" in host or host.replace(".", "").isdigit() or len(labels) < 2:
+            return host
+        domain = ".".join(labels[-2:])
+        if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in cls.second_level_labels:
+            domain = ".".join(labels[-3:])
+        return "youtube.com" if domain in cls.youtube_hosts else domain
+
+    @classmethod
+    def _youtube_id(cls, host, path, query):
+        if host == "youtu.be":
+            return path.strip("/").split("/")[0] or None
+        if path.rstrip("/") == "/watch":
+            return dict(query).get("v")
+        for _prefix in cls.youtube_id_paths:
+            if path.startswith(_prefix):
+                return path[len(_prefix):].strip("/").split("/")[0] or None
+        return None
@@ -1,17 +1,17 @@
 """A generally generic set of utilities."""
 import configparser
+import errno
+import json
 import logging
 import math
 import os
+import shutil
 import sys
+import time
 from datetime import datetime
 from pathlib import Path
 from typing import Union
 
-import iso8601
-import rfc3339
-from dateutil import tz
-
 logger = logging.getLogger(__name__)
 
 
@@ -42,12 +42,141 @@ class Utils:
         if bytes_ is None:
             return "N/A"
         if isinstance(bytes_, str):
-            _bytes = float(bytes_)
-        exponent = 0 if bytes_ == 0.0 else int(math.log(bytes_, 1024.0))
+            bytes_ = float(bytes_)
+        exponent = 0 if bytes_ < 1.0 else int(math.log(bytes_, 1024.0))
         suffix = ["B", "KiB", "MiB", "GiB", "TiB", "PiB", "EiB", "ZiB", "YiB"][exponent]
         converted = float(bytes_) / float(1024 ** exponent)
         return f"{converted:.2f}{suffix}"
 
+    @staticmethod
+    def parse_bytes(size) -> int:
+        """Parse a size from the config, "500M", "1.5GiB" and "1048576" are all fine.
+
+        :param size: A size, with an optional binary unit
+        :type size: [str, int, float, bool]
+        :return: Bytes, 0 for an empty or false value
+        :rtype: int
+        """
+        if not size:
+            return 0
+        if isinstance(size, (int, float)):
+            return int(size)
+        _size = str(size).strip().upper().removesuffix("IB").removesuffix("B")
+        _units = "KMGTPEZY"
+        if _size and _size[-1] in _units:
+            return int(float(_size[:-1]) * 1024 ** (_units.index(_size[-1]) + 1))
+        return int(float(_size))
+
+    @staticmethod
+    def write_json_atomic(path: Union[Path, str], data, **kwargs):
+        """Write <data> as JSON so readers only ever see the old or the new file.
+
+        :param path: Destination path
+        :type path: [Path, str]
+        :param data: JSON serializable data
+        :param kwargs: Passed to `json.dump`
+        :type kwargs: dict
+        """
+        _path = Path(path)
+        _tmp_path = _path.with_name(f".{_path.name}.tmp")
+        with open(_tmp_path, "w") as file:
+            json.dump(data, file, default=str, **kwargs)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(_tmp_path, _path)
+        Utils.fsync_dir(_path.parent)
+
+    @staticmethod
+    def fsync_dir(path: Union[Path, str]):
+        """Flush a directory's entries to disk, so a rename into it survives a crash.
+
+        :param path: The directory
+        :type path: [Path, str]
+        """
+        try:
+            _fd = os.open(path, os.O_RDONLY)
+        except OSError:  # Windows can't open directories, renames there are durable anyway.
+            return
+        try:
+            os.fsync(_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(_fd)
+
+    @staticmethod
+    def move_file(source: Union[Path, str], destination: Union[Path, str]) -> int:
+        """Move a file without reading it into memory.
+
+        The file is renamed if <source> and <destination> are on the same filesystem, otherwise it's copied by
+        the kernel (`copy_file_range`, then `sendfile`) or in chunks, and <source> is removed.
+
+        :param source: File to move
+        :type source: [Path, str]
+        :param destination: New path for the file
+        :type destination: [Path, str]
+        :return: Bytes moved
+        :rtype: int
+        """
+        _size = os.stat(source).st_size
+        try:
+            os.replace(source, destination)
+            return _size
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise e
+        if not Utils._copy_file_range(source, destination, _size):
+            shutil.copyfile(source, destination)  # Uses sendfile where available, chunks otherwise.
+        os.unlink(source)
+        return _size
+
+    @staticmethod
+    def _copy_file_range(source: Union[Path, str], destination: Union[Path, str], size: int) -> bool:
+        """Copy a file with `os.copy_file_range`.
+
+        :return: False if `copy_file_range` isn't available or can't copy between these filesystems
+        :rtype: bool
+        """
+        if not hasattr(os, "copy_file_range"):
+            return False
+        _copied = 0
+        with open(source, "rb") as _src, open(destination, "wb") as _dst:
+            try:
+                while _copied < size:
+                    _n = os.copy_file_range(_src.fileno(), _dst.fileno(), size - _copied)
+                    if _n == 0:
+                        break
+                    _copied += _n
+            except OSError:
+                return False
+        return _copied == size
+
+    @staticmethod
+    def remove_dir(path: Union[Path, str], timeout: float = 30.0) -> bool:
+        """Remove a directory tree, retrying while something still has a file in it open.
+
+        :param path: Directory to remove
+        :type path: [Path, str]
+        :param timeout: Give up after this many seconds
+        :type timeout: float
+        :return: False if the directory could not be removed before the timeout
+        :rtype: bool
+        """
+        _deadline = time.monotonic() + timeout
+        _delay = 0.05
+        while True:
+            try:
+                shutil.rmtree(path)
+                return True
+            except FileNotFoundError:
+                return True
+            except OSError as e:
+                if time.monotonic() >= _deadline:
+                    logger.warning(f"Unable to remove {path}: {e}")
+                    return False
+                time.sleep(_delay)
+                _delay = min(_delay * 2, 1.0)
+
     @staticmethod
     def exiter(level, message=None):
         """Cleanup and exit the application.
@@ -83,18 +212,19 @@ class Utils:
             _destination_path = source_path.with_suffix("." + target_format)
         else:
             _destination_path = Path(destination_path).expanduser()
+        if Path(source_path) == _destination_path:
+            return  # Already in <target_format>, opening it for writing would truncate it.
         try:
-            _file = open(_destination_path, "w")
+            _file = open(_destination_path, "wb")
         except OSError as e:
             logger.error(
                 f"Unable to create thumbnail file {str(_destination_path)}, {str(e)}."
             )
             return
-        try:
-            _image = Image.open(source_path).convert("RGB")
-            _image.save(_file, target_format)
-        except Exception as e:
-            raise e
+        # Close both images and the destination, an open handle blocks removing the temp dir.
+        with _file, Image.open(source_path) as _source:
+            with _source.convert("RGB") as _image:
+                _image.save(_file, target_format)
         if delete_original:
             source_path.unlink()
 
@@ -112,13 +242,16 @@ class Utils:
 
 
 class DateTimeFormatter:
-    """One datetime formatter to rule them all."""
+    """One datetime formatter to rule them all.
+
+    The date libraries are imported when first needed, most commands never parse a date.
+    """
 
     def __init__(self):
         self._usa_format_12 = "%m/%d/%Y %I:%M:%S"
         self._usa_format_24 = "%m/%d/%Y %H:%M:%S"
-        self._global_format_12 = "%d/%m/%Y %H:%M:%S"
-        self._global_format_24 = "%d/%m/%Y %I:%M:%S"
+        self._global_format_12 = "%d/%m/%Y %I:%M:%S"
+        self._global_format_24 = "%d/%m/%Y %H:%M:%S"
 
     def global12(self, dt=None):
         if not dt:
@@ -126,6 +259,8 @@ class DateTimeFormatter:
         try:
             return datetime.fromtimestamp(float(dt)).strftime(self._global_format_12)
         except (TypeError, ValueError):
+            import iso8601
+
             _i = iso8601.parse_date(str(dt))
             return _i.strftime(self._global_format_12)
 
@@ -135,6 +270,8 @@ class DateTimeFormatter:
         try:
             return datetime.fromtimestamp(float(dt)).strftime(self._global_format_24)
         except (TypeError, ValueError):
+            import iso8601
+
             _i = iso8601.parse_date(str(dt))
             return _i.strftime(self._global_format_24)
 
@@ -144,6 +281,8 @@ class DateTimeFormatter:
         try:
             return datetime.fromtimestamp(float(dt)).strftime(self._usa_format_12)
         except (TypeError, ValueError):
+            import iso8601
+
             _i = iso8601.parse_date(str(dt))
             return _i.strftime(self._usa_format_12)
 
@@ -153,16 +292,22 @@ class DateTimeFormatter:
         try:
             return datetime.fromtimestamp(float(dt)).strftime(self._usa_format_24)
         except (TypeError, ValueError):
+            import iso8601
+
             _i = iso8601.parse_date(str(dt))
             return _i.strftime(self._usa_format_24)
 
     @staticmethod
     def r3339(dt=None):
+        import rfc3339
+
         if not dt:
             return rfc3339.rfc3339(datetime.utcnow())
         try:
             return rfc3339.rfc3339(datetime.fromtimestamp(float(dt)))
         except (TypeError, ValueError):
+            import iso8601
+
             _i = iso8601.parse_date(str(dt))
             return rfc3339.rfc3339(_i)
 
@@ -173,6 +318,8 @@ class DateTimeFormatter:
         try:
             return datetime.isoformat(datetime.fromtimestamp(float(dt)))
         except (TypeError, ValueError):
+            import iso8601
+
             return iso8601.parse_date(str(dt))
 
     @staticmethod
@@ -182,6 +329,8 @@ class DateTimeFormatter:
         try:
             return float(dt)
         except (TypeError, ValueError):
+            import iso8601
+
             _i = iso8601.parse_date(str(dt))
             return _i.timestamp()
 
@@ -194,6 +343,8 @@ class DateTimeFormatter:
         :return: Parameter datetime adjusted to use the local timezone
         :rtype: datetime
         """
+        from dateutil import tz
+
         utc_dt = utc_dt.replace(tzinfo=tz.gettz("UTC"))
         return utc_dt.astimezone(tz.tzlocal())
 
@@ -206,6 +357,8 @@ class DateTimeFormatter:
         :return: Parameter datetime adjusted to use the UTC timezone
         :rtype: datetime
         """
+        from dateutil import tz
+
         local_dt = local_dt.replace(tzinfo=tz.tzlocal())
         return local_dt.astimezone(tz.tzlocal())
 
@@ -222,6 +375,8 @@ class DateTimeFormatter:
         :return: A datetime
         :rtype: datetime
         """
+        from dateutil import tz
+
         dt = dt.replace(tzinfo=tz.gettz(source_tz))
         return dt.replace(tzinfo=tz.gettz(dest_tz))
 
@@ -4,9 +4,19 @@ from pathlib import Path, PurePath
 
 import youtube_dl
 
-from PinVidderer.custom_exceptions import VideoFileExists
+from PinVidderer import metrics, progress
+from PinVidderer.custom_exceptions import (
+    DownloadInterrupted,
+    DownloadStalled,
+    InsufficientDiskSpace,
+    VideoFileExists,
+)
 from PinVidderer.history import History
+from PinVidderer.jobs import JobQueue
+from PinVidderer.library import Library
+from PinVidderer.metadata import MetadataPrefetcher
 from PinVidderer.pinboard import Pinboard
+from PinVidderer.retries import RetryPolicy
 from PinVidderer.utils import DateTimeFormatter, PathDetails, Utils
 from PinVidderer.youtubedler import YouTubeDLer
 
@@ -16,9 +26,19 @@ dtf = DateTimeFormatter
 
 
 class Video:
-    def __init__(self, configuration):
+    def __init__(self, configuration, history=None, pinboard=None, jobs=None):
+        """
+        :param configuration: The PinVidderer configuration
+        :type configuration: dict
+        :param history: A shared history, created if not provided
+        :type history: History
+        :param pinboard: A shared Pinboard client, created if not provided
+        :type pinboard: Pinboard
+        :param jobs: Submitted jobs, their state is updated as they're downloaded
+        :type jobs: JobQueue
+        """
         self.configuration = configuration
-        self.pinboard = Pinboard(configuration=self.configuration)
+        self.pinboard = pinboard or Pinboard(configuration=self.configuration)
         config_path = self.configuration.get("dev", {}).get("config_dir")
         history_path = Path(config_path).joinpath(
             self.configuration.get("dev", {}).get("history_file")
@@ -29,27 +49,66 @@ class Video:
         self.backup_file_suffix = self.configuration.get("pinvidderer", {}).get(
             "backup_file_suffix"
         )
-        self.history = History(history_path=history_path)
-        self.youtubedler = YouTubeDLer(configuration=self.configuration)
+        self.history = history or History(
+            history_path=history_path,
+            retry_policy=RetryPolicy.from_config(self.configuration),
+        )
+        self.jobs = jobs or JobQueue()
+        self.youtubedler = YouTubeDLer(configuration=self.configuration, jobs=self.jobs)
+        self.library = Library(configuration=self.configuration, history=self.history)
+
+    def close(self):
+        """Release the downloader."""
+        self.youtubedler.close()
 
-    def preflight(self, bookmark):
+    def preflight(self, bookmark, info=None):
         """Run pre-flight checks, get the video, update the history.
+
+        A video that's already been downloaded from another URL isn't downloaded again, the bookmark is added to
+        the history with the existing file.
         :param bookmark: Pinboard.in bookmark
         :type bookmark: dict
+        :param info: Prefetched youtube-dl info dict for the bookmark
+        :type info: dict
         :return: Status
         :rtype: bool
+        :raises DownloadStalled: The download stalled and should be requeued
         """
         backups = []
         force = self.configuration.get("pinvidderer", {}).get("force")
         logger.debug(f'---------- Downloading {bookmark["description"]}  ----------')
         historical_event = self.history.get_event(bookmark["href"])
-        if not force and historical_event:
+        if historical_event and self.history.retry_due(historical_event):
+            logger.info(f'-- Retrying, attempt {historical_event.get("attempts", 1) + 1}.')
+        elif not force and historical_event:
             logger.warning(f"-- Bookmark is in the history, skipping.")
+            error = "Already in the history."
+            if historical_event.get("nextRetry"):
+                error = f'Failed, retrying at {dtf().global24(historical_event["nextRetry"])}.'
+            self.jobs.update(bookmark["href"], "skipped", error=error)
             return
-        if force and historical_event:
+        if force and historical_event and historical_event["videoFile"]:
             backups = self.backup(historical_event["videoFile"])
         try:
-            video_path, stats = self.youtubedler.get_video(bookmark["href"])
+            if info is None:
+                self.jobs.update(bookmark["href"], "fetching-metadata")
+                info = self.youtubedler.get_info(bookmark["href"])
+            existing_event = None
+            if not force:
+                existing_event = self.history.find_video(
+                    info.get("extractor_key"), info.get("id")
+                )
+            if existing_event and Path(existing_event["videoFile"]).exists():
+                self.link(bookmark, existing_event)
+                return True
+            self.library.admit(bookmark["href"], MetadataPrefetcher.expected_size(info))
+            self.jobs.update(bookmark["href"], "downloading")
+            try:
+                video_path, stats = self.youtubedler.get_video(
+                    bookmark["href"], info=info, description=bookmark["description"]
+                )
+            finally:
+                self.library.release(bookmark["href"])
             self.history.add(
                 stats=stats,
                 url=bookmark["href"],
@@ -60,6 +119,7 @@ class Video:
             )
             self.pinboard.update_bookmarks(bookmark)
             self.delete_backups(backups=backups)
+            self.jobs.update(bookmark["href"], "done")
             return True
         except VideoFileExists:
             logger.warning(
@@ -73,8 +133,23 @@ class Video:
                 error="Video file was found on disk but not in the history.",
             )
             self.pinboard.update_bookmarks(bookmark)
+            self.jobs.update(bookmark["href"], "done")
 
         except youtube_dl.utils.YoutubeDLError as err:
+            metrics.failures.inc(error=type(err).__name__)
+            self.history.add(
+                url=bookmark["href"],
+                description=bookmark["description"],
+                download_completed=False,
+                error=err,
+            )
+            self.restore_backups(backups=backups)
+            self.jobs.update(bookmark["href"], "failed", error=err)
+            return True
+
+        except InsufficientDiskSpace as err:
+            metrics.failures.inc(error=type(err).__name__)
+            logger.error(f"{err}")
             self.history.add(
                 url=bookmark["href"],
                 description=bookmark["description"],
@@ -82,8 +157,59 @@ class Video:
                 error=err,
             )
             self.restore_backups(backups=backups)
+            self.jobs.update(bookmark["href"], "failed", error=err)
             return True
 
+        except DownloadInterrupted as err:
+            logger.warning(f"{err}")
+            self.restore_backups(backups=backups)
+            self.jobs.update(bookmark["href"], "pending", error=err)
+
+        except DownloadStalled as err:
+            metrics.failures.inc(error=type(err).__name__)
+            logger.warning(f"{err}")
+            self.restore_backups(backups=backups)
+            stall_retries = int(
+                self.configuration.get("pinvidderer", {}).get("stall_retries", 3)
+            )
+            if progress.registry.stalled(bookmark["href"]) > stall_retries:
+                self.history.add(
+                    url=bookmark["href"],
+                    description=bookmark["description"],
+                    download_completed=False,
+                    error=err,
+                )
+                self.jobs.update(bookmark["href"], "failed", error=err)
+                return True
+            self.jobs.update(bookmark["href"], "pending")
+            raise err
+
+    def link(self, bookmark, existing_event):
+        """Add <bookmark> to the history with the video file of <existing_event>.
+
+        :param bookmark: Pinboard.in bookmark
+        :type bookmark: dict
+        :param existing_event: Completed download of the same video from another URL
+        :type existing_event: dict
+        """
+        logger.warning(
+            f'-- Same video as {existing_event["url"]}, linking to {existing_event["videoFile"]}.'
+        )
+        self.history.add(
+            stats={
+                "extractorKey": existing_event.get("extractorKey"),
+                "videoId": existing_event.get("videoId"),
+                "linkedFrom": existing_event["url"],
+            },
+            url=bookmark["href"],
+            videofile=existing_event["videoFile"],
+            description=bookmark["description"],
+            download_completed=True,
+            error="none",
+        )
+        self.pinboard.update_bookmarks(bookmark)
+        self.jobs.update(bookmark["href"], "done")
+
     def backup(self, video_file_path) -> list:
         """Backup files before attempting to overwrite.
         :param video_file_path: Path to a video
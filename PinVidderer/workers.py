@@ -0,0 +1,153 @@
+"""Download bookmarks in parallel."""
+import itertools
+import logging
+import threading
+import time
+
+from . import metrics
+from .custom_exceptions import DownloadStalled
+from .hosts import HostScheduler
+from .video import Video
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """A pool of threads running `Video.preflight`.
+
+    Each worker has its own `Video` (and so its own `YouTubeDLer`), the history, Pinboard client and jobs are
+    shared. A bookmark is only queued once while it is waiting or being downloaded. Bookmarks are handed to the
+    workers by a `HostScheduler`, within the [HOSTS] limits higher priorities are downloaded first and hosts
+    with equal priorities take turns.
+    """
+
+    def __init__(self, configuration, workers, history, pinboard, jobs=None):
+        """
+        :param configuration: The PinVidderer configuration
+        :type configuration: dict
+        :param workers: Number of worker threads
+        :type workers: int
+        :param history: The shared history
+        :type history: History
+        :param pinboard: The shared Pinboard client
+        :type pinboard: Pinboard
+        :param jobs: Submitted jobs
+        :type jobs: JobQueue
+        """
+        self.configuration = configuration
+        self.workers = max(int(workers), 1)
+        self.history = history
+        self.pinboard = pinboard
+        self.jobs = jobs
+        self._queue = HostScheduler.from_config(self.configuration)
+        self._sequence = itertools.count()
+        self._threads = []
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def start(self):
+        """Start the worker threads."""
+        for _n in range(1, self.workers + 1):
+            _thread = threading.Thread(
+                target=self._work, name=f"PinVidderer-worker-{_n}", daemon=True
+            )
+            _thread.start()
+            self._threads.append(_thread)
+        logger.debug(f"Started {self.workers} download worker(s).")
+
+    def submit(self, bookmark, info=None, priority=0) -> bool:
+        """Queue a bookmark for download.
+
+        :param bookmark: Pinboard.in bookmark
+        :type bookmark: dict
+        :param info: Prefetched youtube-dl info dict for the bookmark
+        :type info: dict
+        :param priority: Higher priorities are downloaded first
+        :type priority: int
+        :return: False if the bookmark is already queued or downloading
+        :rtype: bool
+        """
+        if self._stopping.is_set():
+            return False
+        with self._pending_lock:
+            if bookmark["href"] in self._pending:
+                logger.debug(f'  Already queued: {bookmark["description"]}')
+                return False
+            self._pending.add(bookmark["href"])
+        self._queue.put(
+            bookmark["href"], (bookmark, info, priority), priority=priority, sequence=next(self._sequence)
+        )
+        return True
+
+    @property
+    def depth(self) -> int:
+        """Number of bookmarks queued or downloading."""
+        with self._pending_lock:
+            return len(self._pending)
+
+    def join(self):
+        """Wait until every queued bookmark has been downloaded, including any requeued ones."""
+        self._queue.join()
+
+    def stop(self):
+        """Stop taking new bookmarks and drop anything still queued, in-flight downloads carry on.
+
+        Doesn't block, the shutdown signal handler's thread calls it while the watcher may be submitting.
+        """
+        self._stopping.set()
+        for _bookmark, _, _ in self._queue.clear():
+            self._done(_bookmark)
+        self._queue.close()
+
+    def shutdown(self, timeout=None):
+        """Stop, then wait for in-flight downloads.
+
+        :param timeout: Seconds to wait, None waits as long as it takes
+        :type timeout: float
+        """
+        self.stop()
+        logger.info("Waiting for in-flight downloads to finish.")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for _thread in self._threads:
+            _thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        if any(_t.is_alive() for _t in self._threads):
+            logger.warning("In-flight downloads didn't finish, they'll resume on the next start.")
+        self._threads = []
+
+    def _work(self):
+        video = Video(
+            configuration=self.configuration,
+            history=self.history,
+            pinboard=self.pinboard,
+            jobs=self.jobs,
+        )
+        try:
+            while True:
+                host, item = self._queue.get()
+                if item is None:
+                    return
+                bookmark, info, priority = item
+                requeue = False
+                try:
+                    video.preflight(bookmark, info=info)
+                except DownloadStalled:
+                    requeue = True
+                except Exception as err:
+                    # Keep the worker alive, the next poll will retry the bookmark.
+                    metrics.failures.inc(error=type(err).__name__)
+                    logger.exception(f'Error downloading {bookmark["href"]}: {err}')
+                    if self.jobs:
+                        self.jobs.update(bookmark["href"], "failed", error=err)
+                finally:
+                    self._done(bookmark)
+                if requeue:
+                    logger.info(f'Requeued {bookmark["description"]}.')
+                    self.submit(bookmark, priority=priority)
+                self._queue.release(host)  # After any requeue, so `join` doesn't see an empty queue.
+        finally:
+            video.close()
+
+    def _done(self, bookmark):
+        with self._pending_lock:
+            self._pending.discard(bookmark["href"])
@@ -1,18 +1,25 @@
 """Download the video and thumbnail."""
 from __future__ import unicode_literals
 
+import hashlib
 import json
 import logging
-import tempfile
+import shutil
+import threading
 import time
 from pathlib import Path
 from typing import Union
+from urllib.parse import urlparse
 
 import youtube_dl
 
-from .custom_exceptions import CouldNotFindPathToVideo
+from . import metrics, progress
+from .custom_exceptions import CouldNotFindPathToVideo, DownloadInterrupted, DownloadStalled
 from .images import Images
+from .jobs import JobQueue
 from .nfo import NFO
+from .progress import DownloadProgress
+from .retries import RetryPolicy
 from .utils import PathDetails, Utils
 
 pd = PathDetails
@@ -20,67 +27,210 @@ utils = Utils()
 
 logger = logging.getLogger(__name__)
 
+# Host -> key of the extractor that last handled a URL from it, shared by every YouTubeDLer.
+_extractor_cache = {}
+_extractor_cache_lock = threading.Lock()
+
 
 class YouTubeDLer:
-    def __init__(self, configuration):
+    """Download videos with youtube-dl.
+
+    The `YoutubeDL` instance, and the hundreds of extractors it creates, is built on first use and reused for
+    every later video. Not thread-safe, use one YouTubeDLer per thread.
+
+    Each URL is downloaded in its own work dir, named after the URL. The work dir is kept if the download stalls,
+    is interrupted or fails in a way that will be retried, so youtube-dl resumes from its .part files on the next
+    attempt.
+    """
+
+    work_dir_name = ".pinvidderer-work"
+    fetched_key = "_pinvidderer_fetched"  # Added to info dicts by `get_info`, epoch time.
+
+    def __init__(self, configuration, jobs=None):
+        """
+        :param configuration: The PinVidderer configuration
+        :type configuration: dict
+        :param jobs: Jobs, their state is updated as they're downloaded
+        :type jobs: JobQueue
+        """
         self.statuses = []
         self.configuration = configuration
-        self.download_dir = self.configuration.get("pinvidderer", {}).get(
-            "download_path"
+        self.jobs = jobs or JobQueue()
+        self.download_dir = Path(
+            self.configuration.get("pinvidderer", {}).get("download_path")
         )
+        self.url = None
         self.tmp_download_dir = None
         self.video_dir = None
+        self.progress = None
+        self.retry_policy = RetryPolicy.from_config(self.configuration)
+        self._ydl = None
+
+    def close(self):
+        """Close the youtube-dl instance."""
+        if self._ydl is not None:
+            self._ydl.__exit__(None, None, None)
+            self._ydl = None
+
+    def get_info(self, url) -> dict:
+        """Get the info dict for a video without downloading it.
 
-    def get_video(self, url):
+        :param url: URL to the video
+        :type url: str
+        :return: youtube-dl info dict
+        :rtype: dict
+        """
+        _ydl = self._get_ydl()
+        try:
+            info = _ydl.extract_info(
+                url, download=False, ie_key=self._get_cached_extractor(_ydl, url)
+            )
+        except youtube_dl.utils.YoutubeDLError as err:
+            _err = str(err).strip()
+            logger.error(f'YoutubeDLError: {_err.removeprefix("ERROR:")}')
+            raise err
+        self._cache_extractor(url, info)
+        # youtube-dl doesn't record when the info dict was made, its media URLs expire.
+        info[self.fetched_key] = time.time()
+        return info
+
+    def get_video(self, url, info=None, description=""):
         """Prepare request for video.
         :param url: URL to the video to download
         :type url: str
+        :param info: A prefetched info dict for <url>, used instead of extracting it again
+        :type info: dict
+        :param description: Bookmark description, for the live status
+        :type description: str
         :return: Path to the video, download performance statistics
         :rtype: Path, dict
+        :raises DownloadStalled: The download was too slow for too long
         """
+        prefetch_max_age = int(
+            self.configuration.get("pinvidderer", {}).get("prefetch_max_age", 1800)
+        )
+        if info and time.time() - info.get(self.fetched_key, 0) > prefetch_max_age:
+            logger.debug("Prefetched metadata is stale, media URLs may have expired.")
+            info = None
         self.statuses = []
-        options = self._get_ydl_options()
-        # Create a tmp directory to work in.
-        with tempfile.TemporaryDirectory(
-            prefix=f"{str(self.download_dir)}/"
-        ) as self.tmp_download_dir:
-            self.tmp_download_dir = Path(self.tmp_download_dir)
+        _pinvidderer = self.configuration.get("pinvidderer", {})
+        self.progress = progress.registry.start(
+            url,
+            description=description,
+            min_rate=_pinvidderer.get("stall_rate", 0),
+            stall_seconds=_pinvidderer.get("stall_seconds", 120),
+        )
+        self.url = url
+        self.jobs.update(url, "downloading" if info else "fetching-metadata")
+        # The work dir is on the same filesystem as the download dir, finalizing is a rename.
+        self.tmp_download_dir = self.get_work_dir(self.download_dir, url)
+        self.tmp_download_dir.mkdir(parents=True, exist_ok=True)
+        keep_work_dir = False
+        try:
             ytd_filename_format = "%(title)s.%(ext)s"
             tmp_output_path = f"{self.tmp_download_dir}/{ytd_filename_format}"
-            options["outtmpl"] = tmp_output_path  # Tell youtube-dl to use the temp dir
+            _ydl = self._get_ydl()
+            _ydl.params["outtmpl"] = tmp_output_path  # Tell youtube-dl to use the temp dir
             try:
-                with youtube_dl.YoutubeDL(options) as _ydl:
-                    video_metadata = _ydl.extract_info(url)
+                if info:
+                    video_metadata = _ydl.process_ie_result(info, download=True)
+                else:
+                    video_metadata = _ydl.extract_info(
+                        url, ie_key=self._get_cached_extractor(_ydl, url)
+                    )
+                    self._cache_extractor(url, video_metadata)
             except youtube_dl.utils.YoutubeDLError as err:
                 _err = str(err).strip()
                 logger.error(f'YoutubeDLError: {_err.removeprefix("ERROR:")}')
                 raise err
             except Exception as err:
                 raise err
+            self.jobs.update(url, "post-processing")
             tmp_video_file_path = self._get_video_filepath()
             if not tmp_video_file_path:
                 raise CouldNotFindPathToVideo(f'Video: {video_metadata["title"]}')
             stats = self._build_download_stats()
+            stats["extractorKey"] = video_metadata.get("extractor_key")
+            stats["videoId"] = video_metadata.get("id")
             if self.configuration.get("nfo", {}).get("create"):
                 nfo = NFO(configuration=self.configuration)
                 nfo.create(video_metadata, tmp_video_file_path)
             if self.configuration.get("pinvidderer", {}).get("get_fanart"):
                 images = Images(configuration=self.configuration)
                 images.process(working_path=self.tmp_download_dir)
-            # Copy the files from the temp dir
+            # Move the files from the temp dir
             self.video_dir = Path(self.video_dir)
             self.video_dir = Path(self.download_dir.joinpath(self.video_dir))
             self.video_dir.mkdir(exist_ok=True)
-            for file in self.tmp_download_dir.iterdir():
-                new_path = self.video_dir.joinpath(file.name)
-                logger.debug(f"Moving {file.name} to {self.video_dir}")
-                new_path.write_bytes(file.read_bytes())
+            self.jobs.update(url, "finalizing")
+            stats.update(self._finalize())
             video_file_path = self.video_dir.joinpath(tmp_video_file_path.name)
-            # Occasionally ?something? is keeping a file open and we crash when the tempfile context
-            # manager can't remove the temp dir. This sleep ?seems? to mitigate that.
-            time.sleep(5)
+        except (DownloadStalled, DownloadInterrupted, KeyboardInterrupt, SystemExit):
+            keep_work_dir = True  # Resumed on the next attempt.
+            raise
+        except youtube_dl.utils.YoutubeDLError as err:
+            # e.g. a connection reset mid-download, the retry resumes. Abandoned work dirs are pruned on start.
+            keep_work_dir = self.retry_policy.retryable(err)
+            raise
+        finally:
+            # Every file in the work dir is opened with a context manager and closed by now, if removal still
+            # fails (e.g. a virus scanner or indexer has a file open) it's retried until the timeout.
+            if not keep_work_dir:
+                utils.remove_dir(self.tmp_download_dir)
+            progress.registry.finish(url)
+            self.url = None
         return video_file_path, stats
 
+    @classmethod
+    def get_work_dir(cls, download_dir, url) -> Path:
+        """The work dir for <url>, the same every time <url> is downloaded.
+
+        :param download_dir: The download directory
+        :type download_dir: Path
+        :param url: URL to the video
+        :type url: str
+        :return: Path to the work dir
+        :rtype: Path
+        """
+        key = hashlib.sha1(url.encode()).hexdigest()[:16]
+        return Path(download_dir).joinpath(cls.work_dir_name, key)
+
+    @classmethod
+    def prune_work_dirs(cls, download_dir, max_age=604800):
+        """Remove work dirs left by downloads that haven't been retried in <max_age> seconds.
+
+        :param download_dir: The download directory
+        :type download_dir: Path
+        :param max_age: In seconds
+        :type max_age: float
+        """
+        work_root = Path(download_dir).joinpath(cls.work_dir_name)
+        if not work_root.is_dir():
+            return
+        for work_dir in work_root.iterdir():
+            if work_dir.is_dir() and time.time() - work_dir.stat().st_mtime > max_age:
+                logger.info(f"Removing abandoned work dir {work_dir}.")
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _finalize(self) -> dict:
+        """Move the files from the temp dir to the video dir.
+
+        :return: Bytes moved and time taken
+        :rtype: dict
+        """
+        moved_bytes = 0
+        started = time.monotonic()
+        for file in list(self.tmp_download_dir.iterdir()):
+            new_path = self.video_dir.joinpath(file.name)
+            logger.debug(f"Moving {file.name} to {self.video_dir}")
+            moved_bytes += utils.move_file(file, new_path)
+        elapsed_float = time.monotonic() - started
+        return {
+            "finalizeBytes": moved_bytes,
+            "finalizeElapsedFloat": elapsed_float,
+            "finalizeStr": f"{utils.format_bytes(moved_bytes)} in {elapsed_float:.2f} seconds",
+        }
+
     def _get_video_filepath(self) -> Union[bool, Path]:
         """Attempt to find the video on disk.
         :return: Path to the video
@@ -122,21 +272,77 @@ class YouTubeDLer:
         rate_bytes = 0
         elapsed_float = 0
         for status in self.statuses:
-            elapsed_float += status["elapsed"]
-            size_bytes += status["downloaded_bytes"]
+            elapsed_float += status.get("elapsed") or 0
+            size_bytes += status.get("downloaded_bytes") or status.get("total_bytes") or 0
         if elapsed_float and size_bytes:
             rate_bytes = size_bytes / elapsed_float
+        rates = self.progress.rates if self.progress else []
+        rate_p50 = DownloadProgress.percentile(rates, 50)
+        rate_p95 = DownloadProgress.percentile(rates, 95)
         elapsed_str = f"{elapsed_float:.2f} seconds"
         size_str = utils.format_bytes(size_bytes)
         rate_str = f"{utils.format_bytes(rate_bytes)}/sec"
+        metrics.download_bytes.observe(size_bytes)
+        metrics.download_seconds.observe(elapsed_float)
+        metrics.download_rate.observe(rate_bytes)
         return {
             "elapsedFloat": elapsed_float,
             "sizeBytes": size_bytes,
+            "rateP50": rate_p50,
+            "rateP95": rate_p95,
             "elapsedStr": elapsed_str,
             "sizeStr": size_str,
             "rateStr": rate_str,
+            "rateP50Str": f"{utils.format_bytes(rate_p50)}/sec",
+            "rateP95Str": f"{utils.format_bytes(rate_p95)}/sec",
         }
 
+    def _get_ydl(self) -> youtube_dl.YoutubeDL:
+        """Get the youtube-dl instance, creating it on first use.
+
+        :return: The youtube-dl instance
+        :rtype: youtube_dl.YoutubeDL
+        """
+        if self._ydl is None:
+            self._ydl = youtube_dl.YoutubeDL(self._get_ydl_options())
+            self._ydl.__enter__()
+        return self._ydl
+
+    @staticmethod
+    def _get_cached_extractor(ydl, url) -> Union[None, str]:
+        """Get the extractor that handled the last URL from this host, if it can handle <url> too.
+
+        :param ydl: The youtube-dl instance
+        :type ydl: youtube_dl.YoutubeDL
+        :param url: URL to the video
+        :type url: str
+        :return: An extractor key, None to let youtube-dl try every extractor
+        :rtype: str
+        """
+        host = urlparse(url).hostname
+        with _extractor_cache_lock:
+            ie_key = _extractor_cache.get(host)
+        if ie_key and ydl.get_info_extractor(ie_key).suitable(url):
+            logger.debug(f"Using the cached {ie_key} extractor for {host}.")
+            return ie_key
+        return None
+
+    @staticmethod
+    def _cache_extractor(url, video_metadata):
+        """Remember which extractor handled <url>.
+
+        :param url: URL to the video
+        :type url: str
+        :param video_metadata: youtube-dl info dict
+        :type video_metadata: dict
+        """
+        ie_key = (video_metadata or {}).get("extractor_key")
+        # The generic extractor matches everything, caching it would hide a better match.
+        if not ie_key or ie_key == "Generic":
+            return
+        with _extractor_cache_lock:
+            _extractor_cache[urlparse(url).hostname] = ie_key
+
     def _get_ydl_options(self):
         """Set youtube-dl options."""
         options = {"format": self.configuration.get("youtubedl", {}).get("format")}
@@ -146,10 +352,18 @@ class YouTubeDLer:
                 "no_color": True,
                 "no_warnings": True,
                 "call_home": "False",
+                # Resume from .part files left in the work dir by an earlier attempt.
+                "continuedl": True,
+                "nopart": False,
             }
         )
         if self.configuration.get("pinvidderer", {}).get("get_fanart"):
             options["writethumbnail"] = "True"
+        if self.configuration.get("pinvidderer", {}).get("stall_rate"):
+            # The progress hook isn't called while a read is blocked, time the read out instead.
+            options["socket_timeout"] = int(
+                self.configuration.get("pinvidderer", {}).get("stall_seconds", 120)
+            )
         logger.debug(f"Youtube-dl options: {json.dumps(options)}")
         options["progress_hooks"] = [self._ydl_hook]
         options["logger"] = YTDLogger()
@@ -157,6 +371,12 @@ class YouTubeDLer:
 
     def _ydl_hook(self, status):
         # logger.debug(status)  # Very verbose
+        if progress.registry.interrupted.is_set():
+            raise DownloadInterrupted(url=self.url)
+        if status["status"] == "downloading" and self.url:
+            self.jobs.update(self.url, "downloading")
+        if self.progress:
+            self.progress.update(status)
         if status["status"] == "finished":
             logger.debug(f"HOOK: {status}")
             self.statuses.append(status)
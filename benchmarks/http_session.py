@@ -0,0 +1,141 @@
+"""Per-request latency of DoHTTP against a local HTTPS server, a shared session vs a session per call.
+
+Before the session was shared every request built a new `requests.Session`, so every request paid for a TCP
+connect and a TLS handshake. Run from the repository root, `openssl` has to be on the PATH for the
+self-signed certificate:
+
+    python -m benchmarks.http_session --requests 200
+"""
+import argparse
+import http.server
+import json
+import ssl
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from PinVidderer.do_http import DoHTTP
+
+
+class SessionPerCall(DoHTTP):
+    """DoHTTP as it was before the session was shared, a new session for every request."""
+
+    @property
+    def session(self):
+        self.close()
+        return DoHTTP.session.fget(self)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Answers every GET with a small JSON body, like posts/update."""
+
+    protocol_version = "HTTP/1.1"  # Keep-alive
+    disable_nagle_algorithm = True  # The headers and body are separate writes, don't wait on a delayed ACK.
+    body = json.dumps({"update_time": "2021-03-01T00:00:00Z"}).encode()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_certificate(directory) -> Path:
+    """Write a self-signed certificate and key for localhost to <directory>.
+
+    :param directory: Where to write it
+    :type directory: Path
+    :return: Path to the PEM with the certificate and the key
+    :rtype: Path
+    """
+    pem = Path(directory).joinpath("localhost.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost",
+            "-keyout", str(pem), "-out", str(pem),
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return pem
+
+
+def serve(pem) -> http.server.ThreadingHTTPServer:
+    """Start a HTTPS server on a free localhost port, in a daemon thread.
+
+    :param pem: Certificate and key
+    :type pem: Path
+    :return: The server
+    :rtype: http.server.ThreadingHTTPServer
+    """
+    server = http.server.ThreadingHTTPServer(("localhost", 0), Handler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(pem)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(client, requests, pem) -> list:
+    """Seconds taken by each of <requests> sequential requests.
+
+    :param client: The client to measure
+    :type client: DoHTTP
+    :param requests: Number of requests
+    :type requests: int
+    :param pem: Certificate to verify the server with
+    :type pem: Path
+    :return: Latencies in seconds
+    :rtype: list
+    """
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.request("posts/update", params={}, verify=str(pem))
+        latencies.append(time.perf_counter() - started)
+        if response is None or response.status_code != 200:
+            raise RuntimeError("The benchmark server didn't answer.")
+    client.close()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per client")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        pem = make_certificate(directory)
+        server = serve(pem)
+        endpoint = f"https://localhost:{server.server_address[1]}/v1/"
+        try:
+            results = {}
+            for name, client_class in [("session per call", SessionPerCall), ("shared session", DoHTTP)]:
+                client = client_class(method="GET", endpoint=endpoint, token="user:TOKEN")
+                measure(client, 5, pem)  # Warm up
+                results[name] = measure(client, args.requests, pem)
+        finally:
+            server.shutdown()
+
+    print(f"{args.requests} sequential GETs over TLS to localhost")
+    for name, latencies in results.items():
+        latencies.sort()
+        p95 = latencies[int(0.95 * (len(latencies) - 1))]
+        print(
+            f"  {name:<17} median {statistics.median(latencies) * 1000:7.2f} ms"
+            f"   p95 {p95 * 1000:7.2f} ms   total {sum(latencies):6.2f} s"
+        )
+    speedup = statistics.median(results["session per call"]) / statistics.median(results["shared session"])
+    print(f"  The shared session is {speedup:.1f}x faster per request.")
+
+
+if __name__ == "__main__":
+    main()
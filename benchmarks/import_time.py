@@ -0,0 +1,133 @@
+"""Import time of the light commands, get-history and remove-from-history, now and at an earlier commit.
+
+Each command is run with `python -X importtime` against a throwaway home directory holding the default config and a
+small history, the time every module took to import is added up. The earlier commit is exported with
+`git archive`, it defaults to the first commit, before the heavy dependencies were imported only by the commands
+that need them. Run from the repository root:
+
+    python -m benchmarks.import_time --runs 5 --before <commit>
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+
+REPOSITORY = Path(__file__).resolve().parents[1]
+HEAVY_MODULES = ["youtube_dl", "requests", "lxml", "iso8601", "dateutil"]
+URL = "https://www.youtube.com/watch?v=benchmark"
+
+
+def export(commit, directory) -> Path:
+    """Export the PinVidderer package at <commit> to <directory>.
+
+    :param commit: A git commit
+    :type commit: str
+    :param directory: Where to export it
+    :type directory: Path
+    :return: The directory, ready for PYTHONPATH
+    :rtype: Path
+    """
+    archive = subprocess.run(
+        ["git", "archive", "--format=tar", commit, "PinVidderer"], cwd=REPOSITORY, check=True, capture_output=True
+    ).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(directory)
+    return Path(directory)
+
+
+def make_home(tree, directory) -> Path:
+    """A home directory with <tree>'s default config and a history with one event, in the pre-log format every
+    version reads.
+
+    :param tree: Where the PinVidderer package is
+    :type tree: Path
+    :param directory: Where to create the home directory
+    :type directory: Path
+    :return: The home directory
+    :rtype: Path
+    """
+    home = Path(directory)
+    config_dir = home.joinpath(".pinvidderer")
+    config_dir.mkdir(parents=True)
+    home.joinpath("PinVidderer").mkdir()
+    shutil.copy(tree.joinpath("PinVidderer", "errata", "config.ini"), config_dir.joinpath("config.ini"))
+    event = {
+        "dateTime": "2021-03-01 12:00:00.000000",
+        "videoFile": "",
+        "url": URL,
+        "description": "Benchmark",
+        "downloadCompleted": False,
+        "error": "Unsupported URL",
+    }
+    with open(config_dir.joinpath("history.json"), "w") as file:
+        json.dump([event], file)
+    return home
+
+
+def run(tree, args) -> tuple:
+    """Run a PinVidderer command with `-X importtime` in a new home directory.
+
+    :param tree: Where the PinVidderer package is
+    :type tree: Path
+    :param args: The command and its options
+    :type args: list
+    :return: Milliseconds spent importing, milliseconds for the whole command, heavy modules it imported
+    :rtype: float, float, list
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, HOME=str(make_home(tree, directory)), PINBOARD_TOKEN="user:TOKEN", PYTHONPATH=str(tree))
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-m", "PinVidderer.PinVidderer", *args],
+            cwd=tree,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        elapsed = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} failed:\n{result.stderr[-2000:]}")
+    imported = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, _, package = line[len("import time:"):].split("|")
+        imported += int(self_us)
+        modules.add(package.strip())
+    return imported / 1000, elapsed, [_m for _m in HEAVY_MODULES if _m in modules]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Runs per command, the median is reported")
+    parser.add_argument("--before", help="Commit to compare with, defaults to the first commit")
+    args = parser.parse_args()
+    before = args.before or subprocess.run(
+        ["git", "rev-list", "--max-parents=0", "HEAD"], cwd=REPOSITORY, check=True, capture_output=True, text=True
+    ).stdout.split()[0]
+
+    commands = [["get-history"], ["remove-from-history", "-u", URL]]
+    with tempfile.TemporaryDirectory() as directory:
+        trees = [(f"before ({before[:10]})", export(before, directory)), ("now", REPOSITORY)]
+        for command in commands:
+            print(f"PinVidderer {' '.join(command)}, median of {args.runs} runs")
+            for name, tree in trees:
+                runs = [run(tree, command) for _ in range(args.runs)]
+                heavy = ", ".join(runs[0][2]) or "none"
+                print(
+                    f"  {name:<22} imports {statistics.median(_r[0] for _r in runs):7.1f} ms"
+                    f"   command {statistics.median(_r[1] for _r in runs):7.1f} ms   heavy modules: {heavy}"
+                )
+
+
+if __name__ == "__main__":
+    main()
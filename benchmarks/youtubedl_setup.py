@@ -0,0 +1,108 @@
+"""Per-video setup overhead of youtube-dl, a new YoutubeDL per video vs a reused one and the extractor cache.
+
+A local fake extractor stands in for a site, so only the setup is measured: building the YoutubeDL instance
+with its hundreds of extractors, and finding the extractor for a URL. The fake extractor is placed last,
+before the generic one, so finding it without the cache tests every other extractor first. Run from the
+repository root:
+
+    python -m benchmarks.youtubedl_setup --videos 50
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+from youtube_dl.extractor.common import InfoExtractor
+
+from PinVidderer import youtubedler
+from PinVidderer.youtubedler import YouTubeDLer
+
+
+class FixtureIE(InfoExtractor):
+    """Answers fixtures.invalid URLs without touching the network."""
+
+    _VALID_URL = r"https?://fixtures\.invalid/(?P<id>\w+)"
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        return {
+            "id": video_id,
+            "title": video_id,
+            "url": f"https://fixtures.invalid/{video_id}.mp4",
+            "ext": "mp4",
+        }
+
+
+class BenchmarkYouTubeDLer(YouTubeDLer):
+    """A YouTubeDLer that can behave as it did before the YoutubeDL instance was reused."""
+
+    def __init__(self, configuration, reuse=True, cache=True):
+        super().__init__(configuration)
+        self.reuse = reuse
+        self.cache = cache
+
+    def _get_ydl(self):
+        if not self.reuse:
+            self.close()
+        created = self._ydl is None
+        ydl = super()._get_ydl()
+        if created:
+            ydl.add_info_extractor(FixtureIE())
+            # Before the generic extractor, which matches every URL.
+            ydl._ies.insert(-1, ydl._ies.pop())
+        return ydl
+
+    def _get_cached_extractor(self, ydl, url):
+        return super()._get_cached_extractor(ydl, url) if self.cache else None
+
+
+def measure(downloader, videos) -> list:
+    """Seconds taken to get the info dict for each of <videos> videos.
+
+    :param downloader: The downloader to measure
+    :type downloader: BenchmarkYouTubeDLer
+    :param videos: Number of videos
+    :type videos: int
+    :return: Latencies in seconds
+    :rtype: list
+    """
+    youtubedler._extractor_cache.clear()
+    latencies = []
+    for n in range(videos):
+        started = time.perf_counter()
+        info = downloader.get_info(f"https://fixtures.invalid/video{n}")
+        latencies.append(time.perf_counter() - started)
+        if info["extractor_key"] != FixtureIE.ie_key():
+            raise RuntimeError(f"{info['extractor_key']} handled the fixture URL.")
+    downloader.close()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--videos", type=int, default=50, help="Videos per mode")
+    args = parser.parse_args()
+
+    modes = [
+        ("new YoutubeDL per video", {"reuse": False, "cache": False}),
+        ("reused YoutubeDL", {"reuse": True, "cache": False}),
+        ("reused + extractor cache", {"reuse": True, "cache": True}),
+    ]
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        configuration = {"pinvidderer": {"download_path": directory}, "youtubedl": {"format": "best"}}
+        for name, options in modes:
+            downloader = BenchmarkYouTubeDLer(configuration, **options)
+            measure(downloader, 2)  # Warm up, imports the extractor modules
+            results[name] = measure(downloader, args.videos)
+
+    print(f"Info dicts for {args.videos} videos from a local fake extractor")
+    for name, latencies in results.items():
+        print(
+            f"  {name:<25} median {statistics.median(latencies) * 1000:8.2f} ms"
+            f"   first {latencies[0] * 1000:8.2f} ms   total {sum(latencies):6.2f} s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""The history log: a multi-process stress test, its indexes and streaming it newest first."""
+import multiprocessing
+import threading
+
+from PinVidderer.history_store import JSONLogStore
+
+WRITERS = 6
+EVENTS_PER_WRITER = 300
+
+
+def _write(log_path, writer):
+    # Compact as often as possible, so compactions race with the other writers' appends.
+    JSONLogStore.compact_min_records = 10
+    store = JSONLogStore(log_path)
+    for n in range(EVENTS_PER_WRITER):
+        url = f"https://example.com/{writer}/{n}"
+        # Two superseded records per event, so stale records outnumber live events and compaction keeps running.
+        store.put({"url": url, "writer": writer, "n": n, "downloadCompleted": False})
+        store.put({"url": url, "writer": writer, "n": n, "downloadCompleted": False})
+        store.put({"url": url, "writer": writer, "n": n, "downloadCompleted": n % 3 == 0})
+
+
+def test_concurrent_writers_and_reader_lose_nothing(tmp_path, monkeypatch):
+    monkeypatch.setattr(JSONLogStore, "compact_min_records", 10)
+    log_path = tmp_path / "history.jsonl"
+    JSONLogStore(log_path)
+    context = multiprocessing.get_context("spawn")
+    writers = [
+        context.Process(target=_write, args=(log_path, _w)) for _w in range(WRITERS)
+    ]
+    for writer in writers:
+        writer.start()
+
+    # A reader in this process refreshes while the writers append and compact, every snapshot must parse and
+    # only ever grow.
+    reader = JSONLogStore(log_path)
+    reader_errors = []
+    done = threading.Event()
+
+    def _read():
+        seen = 0
+        while not done.is_set():
+            try:
+                events = reader.all()
+            except Exception as err:  # pragma: no cover - reported below
+                reader_errors.append(err)
+                return
+            if len(events) < seen:
+                reader_errors.append(AssertionError(f"Snapshot shrank from {seen} to {len(events)}"))
+                return
+            seen = len(events)
+
+    reader_thread = threading.Thread(target=_read)
+    reader_thread.start()
+    for writer in writers:
+        writer.join(timeout=120)
+        assert writer.exitcode == 0
+    done.set()
+    reader_thread.join()
+    assert not reader_errors
+
+    events = {_e["url"]: _e for _e in JSONLogStore(log_path).all()}
+    assert len(events) == WRITERS * EVENTS_PER_WRITER
+    for writer in range(WRITERS):
+        for n in range(EVENTS_PER_WRITER):
+            event = events[f"https://example.com/{writer}/{n}"]
+            assert event["downloadCompleted"] is (n % 3 == 0)
+    # The log was compacted, not just appended to.
+    assert sum(1 for _ in open(log_path)) < WRITERS * EVENTS_PER_WRITER * 3
+
+
+def test_ordered_index_follows_puts_and_removes(tmp_path):
+    def retry_key(event):
+        return None if event["downloadCompleted"] else event.get("nextRetry")
+
+    log_path = tmp_path / "history.jsonl"
+    store = JSONLogStore(log_path, ordered_indexes={"nextRetry": retry_key})
+    for n in range(20):
+        store.put({"url": f"https://example.com/{n}", "downloadCompleted": False, "nextRetry": (n * 7) % 20})
+    store.put({"url": "https://example.com/3", "downloadCompleted": True, "nextRetry": 1})
+    store.put({"url": "https://example.com/4", "downloadCompleted": False, "nextRetry": 30})
+    store.remove("https://example.com/5")
+
+    expected = sorted((retry_key(_e), _e["url"]) for _e in store.all() if retry_key(_e) is not None)
+    for reader in [store, JSONLogStore(log_path, ordered_indexes={"nextRetry": retry_key}, read_only=True)]:
+        assert [(_e["nextRetry"], _e["url"]) for _e in reader.ordered("nextRetry")] == expected
+        assert [_e["nextRetry"] for _e in reader.ordered("nextRetry", until=9)] == [_k for _k, _ in expected if _k <= 9]
+        assert reader.ordered("nextRetry", limit=1)[0]["url"] == expected[0][1]
+
+
+def test_read_only_newest_first_streams_the_current_events(tmp_path, monkeypatch):
+    monkeypatch.setattr(JSONLogStore, "read_block_size", 64)  # Records span blocks.
+    log_path = tmp_path / "history.jsonl"
+    store = JSONLogStore(log_path)
+    store.put({"url": "https://example.com/cleared", "downloadCompleted": True})
+    store.clear()
+    for n in range(30):
+        store.put({"url": f"https://example.com/{n}", "downloadCompleted": False, "n": n})
+    store.put({"url": "https://example.com/3", "downloadCompleted": True, "n": 3})
+    store.remove("https://example.com/7")
+    with open(log_path, "ab") as file:
+        file.write(b'{"op": "put", "event": {"url": "https://example.com/partial"')
+
+    expected = list(reversed(store.all()))
+    assert list(JSONLogStore(log_path, read_only=True).events(newest_first=True)) == expected
+
+    # Stopping early reads only the end of the log.
+    reads = []
+    monkeypatch.setattr(JSONLogStore, "_apply", lambda self, record: reads.append(record))
+    newest = JSONLogStore(log_path, read_only=True).events(newest_first=True)
+    assert [next(newest)["url"] for _ in range(2)] == ["https://example.com/3", "https://example.com/29"]
+    newest.close()
+    assert reads == []
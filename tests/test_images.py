@@ -0,0 +1,56 @@
+"""Converting thumbnails doesn't leak file handles, an open handle blocks removing the work dir on Windows."""
+import os
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from PinVidderer.images import Images  # noqa: E402
+from PinVidderer.utils import Utils  # noqa: E402
+
+ITERATIONS = 50
+FD_DIR = "/proc/self/fd"
+
+pytestmark = [
+    pytest.mark.skipif(not os.path.isdir(FD_DIR), reason="Counts open files with /proc/self/fd."),
+    # CPython closes a leaked file as soon as the last reference goes, so the count alone can miss a leak. Closing
+    # it that way warns.
+    pytest.mark.filterwarnings("error::ResourceWarning"),
+    pytest.mark.filterwarnings("error::pytest.PytestUnraisableExceptionWarning"),
+]
+
+
+def _open_fds() -> int:
+    return len(os.listdir(FD_DIR))
+
+
+def _write_thumbnail(path):
+    Image.new("RGB", (320, 180), color=(200, 30, 30)).save(path, "WEBP")
+
+
+def test_format_converter_closes_every_file(tmp_path):
+    source = tmp_path / "thumbnail.webp"
+    _write_thumbnail(source)
+    Utils.image_format_converter(source, "jpeg", destination_path=tmp_path / "warmup.jpg")
+    before = _open_fds()
+    for n in range(ITERATIONS):
+        destination = tmp_path / f"fanart{n}.jpg"
+        Utils.image_format_converter(source, "jpeg", destination_path=destination)
+        with Image.open(destination) as image:
+            assert image.format == "JPEG"
+    assert _open_fds() == before
+
+
+def test_fanart_processing_closes_every_file(tmp_path):
+    images = Images(configuration={"pinvidderer": {"get_fanart": True, "fanart_format": "jpeg"}})
+    before = None
+    for n in range(ITERATIONS):
+        work_dir = tmp_path / f"work{n}"
+        work_dir.mkdir()
+        _write_thumbnail(work_dir / f"video{n}.webp")
+        images.process(working_path=work_dir)
+        assert [_f.name for _f in work_dir.iterdir()] == ["fanart.jpeg"]
+        assert Utils.remove_dir(work_dir)
+        if before is None:
+            before = _open_fds()  # After the first, Pillow's plugins are loaded.
+    assert _open_fds() == before
@@ -0,0 +1,70 @@
+"""Commands that don't download (status, wake, get-history) don't pay for importing the downloaders."""
+import json
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import PinVidderer
+
+HEAVY_MODULES = ["youtube_dl", "requests", "lxml", "iso8601", "dateutil"]
+URL = "https://www.youtube.com/watch?v=lazy"
+
+
+@pytest.fixture
+def home(tmp_path):
+    """A home directory with the default config and a history with one event."""
+    config_dir = tmp_path.joinpath(".pinvidderer")
+    config_dir.mkdir()
+    tmp_path.joinpath("PinVidderer").mkdir()
+    shutil.copy(Path(PinVidderer.__file__).parent.joinpath("errata", "config.ini"), config_dir)
+    event = {
+        "dateTime": "2021-03-01 12:00:00.000000",
+        "videoFile": "",
+        "url": URL,
+        "description": "Lazy",
+        "downloadCompleted": False,
+        "error": "Unsupported URL",
+    }
+    with open(config_dir.joinpath("history.jsonl"), "w") as file:
+        file.write(json.dumps({"op": "put", "event": event}) + "\n")
+    return tmp_path
+
+
+def _heavy_imports(code, home=None) -> list:
+    """Run <code> in a fresh interpreter, this one may already have imported them, and return the heavy modules
+    it imported."""
+    code += f"\nprint(' '.join(_m for _m in {HEAVY_MODULES!r} if _m in sys.modules))\n"
+    env = dict(os.environ, PINBOARD_TOKEN="user:TOKEN")
+    if home:
+        env["HOME"] = str(home)
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.splitlines()[-1].split() if result.stdout.strip() else []
+
+
+def test_client_import_is_lazy():
+    assert _heavy_imports("import sys\nimport PinVidderer.client\n") == []
+
+
+def test_cli_import_is_lazy():
+    assert _heavy_imports("import sys\nimport PinVidderer.PinVidderer\n") == []
+
+
+@pytest.mark.parametrize(
+    "args, output",
+    [(["get-history", "-n"], URL), (["remove-from-history", "-u", URL], "")],
+)
+def test_light_commands_are_lazy(home, args, output):
+    code = (
+        "import sys\n"
+        "from click.testing import CliRunner\n"
+        "from PinVidderer.PinVidderer import cli\n"
+        f"result = CliRunner().invoke(cli, {args!r})\n"
+        "assert result.exit_code == 0, (result.output, result.exception)\n"
+        f"assert {output!r} in result.output, result.output\n"
+    )
+    assert _heavy_imports(code, home=home) == []
@@ -0,0 +1,13 @@
+"""Download progress statistics."""
+from PinVidderer.progress import DownloadProgress
+
+
+def test_percentile_is_nearest_rank():
+    percentile = DownloadProgress.percentile
+    assert percentile([], 50) == 0.0
+    assert percentile([1, 2], 50) == 1.0
+    assert percentile([1, 2, 3, 4], 50) == 2.0
+    assert percentile(list(range(1, 21)), 95) == 19.0
+    assert percentile(list(range(1, 101)), 95) == 95.0
+    assert percentile([3, 1, 2], 0) == 1.0
+    assert percentile([3, 1, 2], 100) == 3.0
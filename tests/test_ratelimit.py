@@ -0,0 +1,38 @@
+"""A call counted against several buckets waits for all of them and uses the same slot in each."""
+import time
+
+import pytest
+
+from PinVidderer.custom_exceptions import RateLimited
+from PinVidderer.do_http import DoHTTP
+from PinVidderer.ratelimit import TokenBucket
+
+GENERAL = 0.1
+POSTS_ALL = 0.3
+
+
+def test_every_matching_prefix_is_limited():
+    general, posts_all = TokenBucket(interval=GENERAL), TokenBucket(interval=POSTS_ALL)
+    rate_limits = {"/v1/": general, "/v1/posts/all": posts_all}
+    client = DoHTTP("GET", "https://api.pinboard.in", "user:TOKEN", rate_limits=rate_limits)
+    assert client._get_limiters("/v1/posts/all") == [general, posts_all]
+    assert client._get_limiters("/v1/posts/add") == [general]
+    assert client._get_limiters("/v2/") == []
+
+
+def test_acquire_all_waits_for_the_slowest_bucket():
+    general, posts_all = TokenBucket(interval=GENERAL), TokenBucket(interval=POSTS_ALL)
+    assert TokenBucket.acquire_all([general, posts_all]) == 0
+    started = time.monotonic()
+    TokenBucket.acquire_all([general, posts_all])
+    assert time.monotonic() - started >= POSTS_ALL * 0.9
+    # The general bucket's slot was taken when the second call went out, not when it started waiting.
+    assert general.acquire() >= GENERAL * 0.9
+
+
+def test_acquire_all_takes_nothing_when_it_would_wait_too_long():
+    general, posts_all = TokenBucket(interval=GENERAL), TokenBucket(interval=POSTS_ALL)
+    posts_all.acquire()
+    with pytest.raises(RateLimited):
+        TokenBucket.acquire_all([general, posts_all], max_wait=GENERAL)
+    assert general.acquire(max_wait=0) == 0
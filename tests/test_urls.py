@@ -0,0 +1,25 @@
+"""Canonical URLs."""
+import pytest
+
+from PinVidderer.urls import CanonicalURL
+
+
+@pytest.mark.parametrize(
+    "url, canonical",
+    [
+        ("https://youtu.be/abc?si=tracking", "https://youtube.com/watch?v=abc"),
+        ("https://m.youtube.com/watch?v=abc&feature=share", "https://youtube.com/watch?v=abc"),
+        ("https://www.youtube.com/shorts/abc", "https://youtube.com/watch?v=abc"),
+        # youtube-dl downloads the whole playlist, it isn't the same as the video.
+        ("https://www.youtube.com/watch?v=abc&list=PL1", "https://youtube.com/watch?list=PL1&v=abc"),
+        ("https://youtu.be/abc?list=PL1&index=3", "https://youtube.com/watch?index=3&list=PL1&v=abc"),
+        ("https://www.youtube.com/playlist?list=PL1", "https://youtube.com/playlist?list=PL1"),
+    ],
+)
+def test_canonicalize(url, canonical):
+    assert CanonicalURL.canonicalize(url) == canonical
+
+
+def test_playlist_isnt_the_video():
+    video = CanonicalURL.canonicalize("https://www.youtube.com/watch?v=abc")
+    assert CanonicalURL.canonicalize("https://www.youtube.com/watch?v=abc&list=PL1") != video
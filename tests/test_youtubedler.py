@@ -0,0 +1,87 @@
+"""Back to back downloads leave nothing behind in the work dirs, and never sleep."""
+import time
+import types
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("youtube_dl")
+pytest.importorskip("lxml")
+
+from PinVidderer import youtubedler  # noqa: E402
+from PinVidderer.utils import Utils  # noqa: E402
+
+VIDEOS = 10
+
+
+class FakeExtractor:
+    @staticmethod
+    def suitable(url):
+        return url.startswith("https://fixtures.invalid/")
+
+
+class FakeYoutubeDL:
+    """Writes a fixture video into the work dir, like youtube-dl does."""
+
+    def __init__(self, params):
+        self.params = params
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def get_info_extractor(self, ie_key):
+        return FakeExtractor
+
+    def extract_info(self, url, download=True, ie_key=None):
+        title = url.rsplit("/", 1)[-1]
+        video_file = Path(self.params["outtmpl"] % {"title": title, "ext": "mp4"})
+        with open(video_file, "wb") as file:
+            file.write(b"\0" * 4096)
+        for hook in self.params["progress_hooks"]:
+            hook({"status": "downloading", "filename": str(video_file), "downloaded_bytes": 2048})
+            hook(
+                {
+                    "status": "finished",
+                    "filename": str(video_file),
+                    "downloaded_bytes": 4096,
+                    "elapsed": 0.01,
+                }
+            )
+        return {"id": title, "title": title, "ext": "mp4", "extractor_key": "Fixture"}
+
+
+def test_batch_leaves_no_work_dirs_and_never_sleeps(tmp_path, monkeypatch):
+    fake = types.SimpleNamespace(YoutubeDL=FakeYoutubeDL, utils=youtubedler.youtube_dl.utils)
+    monkeypatch.setattr(youtubedler, "youtube_dl", fake)
+
+    def _no_sleep(seconds):
+        raise AssertionError(f"Slept for {seconds} seconds.")
+
+    monkeypatch.setattr(time, "sleep", _no_sleep)
+    removals = []
+    remove_dir = Utils.remove_dir
+
+    def _remove_dir(path, timeout=30.0):
+        removals.append(remove_dir(path, timeout=timeout))
+        return removals[-1]
+
+    monkeypatch.setattr(Utils, "remove_dir", staticmethod(_remove_dir))
+
+    downloader = youtubedler.YouTubeDLer(
+        configuration={"pinvidderer": {"download_path": str(tmp_path)}, "youtubedl": {"format": "best"}}
+    )
+    try:
+        for n in range(VIDEOS):
+            video_file, stats = downloader.get_video(f"https://fixtures.invalid/video{n}")
+            assert video_file == tmp_path / f"video{n}" / f"video{n}.mp4"
+            assert video_file.stat().st_size == 4096
+            assert stats["videoId"] == f"video{n}"
+    finally:
+        downloader.close()
+
+    assert removals == [True] * VIDEOS
+    work_root = tmp_path / youtubedler.YouTubeDLer.work_dir_name
+    assert not work_root.exists() or not any(work_root.iterdir())